@@ -1,59 +1,337 @@
+import os
+import re
+import json
+import hashlib
+from pathlib import Path
+from concurrent.futures import Future
 from photo import Photo
-from conf import CONFIG, write_json
+from conf import CONFIG, atomic_write, write_album_json, stored_path
+from encode import formats_of, output_path
+from metrics import METRICS
+
+ORDER_BY_MAP = {
+    'access': 'st_atime',
+    'modify': 'st_mtime',
+    'create': 'st_ctime',
+}
+
+# The photo name of a thumbnail, e.g. 'a' for 'a.min.webp' or 'a.640w.min.webp'
+THUMBNAIL_NAME = re.compile(r'^(.*?)(?:\.\d+w)?\.min\.[^.]+$')
+
+# Stems of the sources kept for an album at its last ingest, in its store
+STORED_LIST = '.horcrux-sources'
+
+# Entry fields read from the EXIF of a photo
+EXIF_FIELDS = ('camera', 'aperture', 'exposure', 'iso', 'focal')
+
+# Settings that change an album's config for the same files
+ALBUM_SETTINGS = (
+    'SORT_ALBUMS_BY_TIME',
+    'REVERSE_ALBUMS_ORDER',
+    'ORDER_ALBUMS_BY_LAST_DO',
+    'SORT_PHOTOS_BY_TIME',
+    'REVERSE_PHOTOS_ORDER',
+    'ORDER_PHOTOS_BY_LAST_DO',
+)
 
 
 class Album:
-    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.gif'}
+    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.gif', '.webp', '.avif'}
 
-    def __init__(self, path, name, root):
+    def __init__(self, path, name, root, pool=None, cache=None, leaves=None, previous=None, duplicates=None):
         self.path = path
         self.name = name
         self.root = root or 0
+        self.pool = pool
+        self.cache = cache
+        # Items of every album without sub-albums, by the path used in its config
+        self.leaves = {} if leaves is None else leaves
+        # The album's config in the last build, reused if the album is unchanged
+        self.previous = previous
+        # Perceptual hash index of the gallery, set when looking for duplicates
+        self.duplicates = duplicates
+        self.entries = None
+        self.children = None
+        self.fingerprint = None
+        self.changed = False
         self.items_order = []
         self.items_dict = {}
 
     def _get_sorted_paths(self, entries, type_):
-        def sort_key(entry):
-            order_by_map = {
-                'access': 'st_atime',
-                'modify': 'st_mtime',
-                'create': 'st_ctime',
-            }
-
-            conf_map = {
-                'album': {
-                    'order_by': CONFIG.ORDER_ALBUMS_BY_LAST_DO,
-                    'sort_by_time': CONFIG.SORT_ALBUMS_BY_TIME,
-                    'reverse': CONFIG.REVERSE_ALBUMS_ORDER,
-                },
-                'photo': {
-                    'order_by': CONFIG.ORDER_PHOTOS_BY_LAST_DO,
-                    'sort_by_time': CONFIG.SORT_PHOTOS_BY_TIME,
-                    'reverse': CONFIG.REVERSE_PHOTOS_ORDER,
-                }
-            }
-
-            if conf_map[type_]['sort_by_time']:
-                attr = order_by_map[conf_map[type_]['order_by']]
-                return getattr(entry.stat(), attr)
-            return entry.name
+        """
+        Sort directory entries by name or by time. The stat result is cached
+        on each os.DirEntry, so every entry is stat'ed at most once.
+        """
+        if type_ == 'album':
+            sort_by_time = CONFIG.SORT_ALBUMS_BY_TIME
+            order_by = CONFIG.ORDER_ALBUMS_BY_LAST_DO
+            reverse = CONFIG.REVERSE_ALBUMS_ORDER
+        else:
+            sort_by_time = CONFIG.SORT_PHOTOS_BY_TIME
+            order_by = CONFIG.ORDER_PHOTOS_BY_LAST_DO
+            reverse = CONFIG.REVERSE_PHOTOS_ORDER
 
-        reverse = CONFIG.REVERSE_ALBUMS_ORDER if type_ == 'album' else CONFIG.REVERSE_PHOTOS_ORDER
-        return sorted(entries, key=sort_key, reverse=reverse)
+        if sort_by_time:
+            attr = ORDER_BY_MAP[order_by]
+            return sorted(entries, key=lambda entry: getattr(entry.stat(), attr), reverse=reverse)
+        return sorted(entries, key=lambda entry: entry.name, reverse=reverse)
 
-    def _is_image(self, path):
+    def _is_image(self, entry):
         # Reject miniature images like 'photo.min.jpg'
+        name = entry.name.lower()
         return (
-            path.is_file()
-            and path.suffix.lower() in self.IMAGE_EXTENSIONS
-            and '.min.' not in path.name.lower()
+            entry.is_file()
+            and os.path.splitext(name)[1] in self.IMAGE_EXTENSIONS
+            and '.min.' not in name
         )
 
+    def _stored_entries(self):
+        store = stored_path(self.path)
+        try:
+            with os.scandir(store) as it:
+                return [entry for entry in it if self._is_image(entry)]
+        except (TypeError, OSError):
+            # Outside of CONFIG.PHOTOS_PATH, or nothing kept yet
+            return []
+
+    def _stored_list(self):
+        """The stems kept in the store at the last ingest, or None."""
+        try:
+            with open(stored_path(self.path) / STORED_LIST, 'r') as f:
+                return set(json.load(f))
+        except (TypeError, OSError, ValueError):
+            return None
+
+    def _scan(self):
+        """
+        List the album in one pass, the entry types come with the listing.
+
+        Its photos are the sources kept for it in CONFIG.SOURCES_PATH, and
+        the photos in the album itself which aren't published from those,
+        nor from sources deleted since.
+        """
+        stored_entries = self._stored_entries()
+        stored = {os.path.splitext(entry.name)[0] for entry in stored_entries}
+        # Outputs of deleted sources are removed by the next ingest
+        stored |= self._stored_list() or set()
+        image_entries = []
+        sub_album_entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    sub_album_entries.append(entry)
+                elif self._is_image(entry) and os.path.splitext(entry.name)[0] not in stored:
+                    image_entries.append(entry)
+        return stored_entries + image_entries, sub_album_entries
+
+    def _ingest(self):
+        """
+        Move the new photos of the album to CONFIG.SOURCES_PATH, the album
+        then gets copies derived from them. Photos with thumbnails next to
+        them were published before sources were kept, they stay in place.
+
+        The photos derived from sources deleted since the last ingest are
+        removed, and a photo with the name of a kept source is reported,
+        as it would be published as is.
+        """
+        store = stored_path(self.path)
+        if store is None:
+            return
+        outputs = {}
+        for entry in self._stored_entries():
+            outputs[os.path.splitext(entry.name)[0]] = {
+                output_path(Path(entry.name), name).name
+                for name in formats_of(CONFIG.ORIGINAL_ENCODING)
+            }
+        previous = self._stored_list()
+        removed = (previous or set()) - set(outputs)
+        published = set()
+        new = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                match = THUMBNAIL_NAME.match(entry.name)
+                stem = match.group(1) if match else os.path.splitext(entry.name)[0]
+                if stem in removed and (match or self._is_image(entry)):
+                    os.unlink(entry.path)
+                    print(f"Removing photo of a deleted source: {entry.path}")
+                elif match:
+                    published.add(stem)
+                elif self._is_image(entry):
+                    new.append(entry)
+        for entry in new:
+            stem = os.path.splitext(entry.name)[0]
+            if stem in outputs:
+                if entry.name not in outputs[stem]:
+                    print(f"Conflict: {entry.path} has the name of a kept source in {store}, "
+                          "replace the source or rename the photo")
+                continue
+            if stem in published:
+                continue
+            store.mkdir(parents=True, exist_ok=True)
+            os.replace(entry.path, store / entry.name)
+            outputs[stem] = set()
+            print(f"Keeping source: {store / entry.name}")
+        if store.is_dir() and previous != set(outputs):
+            with atomic_write(store / STORED_LIST) as tmp, open(tmp, 'w') as f:
+                json.dump(sorted(outputs), f)
+
+    def scan(self, ingest=True):
+        """
+        List the album and its sub-albums, and fingerprint every one of them.
+        New photos are moved to CONFIG.SOURCES_PATH first, unless ingest is
+        False. They keep their name, size and times, so their fingerprint
+        is the same either way.
+        """
+        if ingest:
+            self._ingest()
+        self.entries = self._scan()
+        self.children = [
+            Album(self.path / entry.name, entry.name, self.root + 1,
+                  self.pool, self.cache, self.leaves, duplicates=self.duplicates)
+            for entry in self._get_sorted_paths(self.entries[1], 'album')
+        ]
+        for child in self.children:
+            child.scan(ingest)
+        self.fingerprint = self._fingerprint()
+        return self.fingerprint
+
+    def _fingerprint(self):
+        """
+        Hash the names, sizes and times of the photos and the fingerprints of
+        the sub-albums: a change anywhere below the album changes it.
+        """
+        image_entries, sub_album_entries = self.entries
+        children = {child.name: child.fingerprint for child in self.children}
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr([getattr(CONFIG, name) for name in ALBUM_SETTINGS]).encode())
+        for entry in sorted(image_entries, key=lambda entry: entry.name):
+            stat = entry.stat()
+            sort_time = self._sort_time(stat, 'photo')
+            digest.update(f'{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\0{sort_time}\n'.encode())
+        for entry in sorted(sub_album_entries, key=lambda entry: entry.name):
+            if entry.name in children:
+                sort_time = self._sort_time(entry.stat(), 'album')
+                digest.update(f'{entry.name}/\0{children[entry.name]}\0{sort_time}\n'.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _sort_time(stat, type_):
+        # Albums sorted by time move when the time changes
+        if type_ == 'album' and CONFIG.SORT_ALBUMS_BY_TIME:
+            return getattr(stat, ORDER_BY_MAP[CONFIG.ORDER_ALBUMS_BY_LAST_DO])
+        if type_ == 'photo' and CONFIG.SORT_PHOTOS_BY_TIME:
+            return getattr(stat, ORDER_BY_MAP[CONFIG.ORDER_PHOTOS_BY_LAST_DO])
+        return ''
+
+    def _unchanged(self):
+        """
+        Whether the album and its sub-albums are as they were in the last
+        build, and its config and album files can be reused.
+        """
+        if self.cache is None or CONFIG.ALBUM_FILES == 'skip':
+            return False
+        if self.previous is None or self.previous.get('type') != 'album':
+            return False
+        if self.cache.album(self.path) != self.fingerprint:
+            return False
+        if self._shares():
+            # The files of the originals may have moved since
+            return False
+        # A deleted album file or photo output is derived again
+        return _outputs_exist(self.previous)
+
+    def _shares(self):
+        """Whether a photo of the album or its sub-albums is or was a shared duplicate."""
+        for entry in self.entries[0]:
+            path = Path(entry.path)
+            if self.cache.is_shared(path) or (self.duplicates is not None and self.duplicates.is_shared(path)):
+                return True
+        return any(child._shares() for child in self.children)
+
+    def _keep(self):
+        self.cache.put_album(self.path, self.fingerprint, kept=True)
+        for child in self.children:
+            child._keep()
+
+    def _format_photo(self, photo_path, entry):
+        """
+        Return the cached or formatted entry, or a future when a pool is used.
+        A shared duplicate gets the entry of its original.
+        """
+        photo_conf = None
+        if self.cache is not None:
+            photo_conf = self.cache.get(photo_path, entry.stat(), self._original(photo_path))
+        if self.duplicates is not None:
+            shared = self.duplicates.shared(photo_path)
+            if shared is not None:
+                if isinstance(shared, Future):
+                    return shared
+                return self._cache_photo(photo_path, shared)
+        if photo_conf is not None:
+            METRICS.count('cached')
+        else:
+            self.changed = True
+            if self.pool is not None:
+                photo_conf = self.pool.submit(photo_path)
+            else:
+                photo_conf = self._cache_photo(photo_path, Photo(photo_path).format())
+        if self.duplicates is not None:
+            self.duplicates.register(photo_path, photo_conf)
+        return photo_conf
+
+    def _cache_photo(self, photo_path, photo_conf):
+        if self.cache is not None:
+            self.cache.put(photo_path, photo_conf, self._original(photo_path))
+        return photo_conf
+
+    def _original(self, photo_path):
+        """The original a photo shares its entry with, or None."""
+        return self.duplicates.original(photo_path) if self.duplicates is not None else None
+
+    def _album_file(self):
+        return CONFIG.ALBUMS_PATH / ('-'.join(self._get_album_metadata()) + '.json')
+
+    def _previous_photos(self):
+        """The photo entries of the last build and their keys, by published path."""
+        if self.children:
+            items = (self.previous or {}).get('items', {})
+        else:
+            try:
+                with open(self._album_file(), 'r') as f:
+                    items = json.load(f)
+            except (OSError, ValueError):
+                items = {}
+        return {
+            entry['path']: (key, entry)
+            for key, entry in items.get('dict', {}).items()
+            if isinstance(entry, dict) and entry.get('type') == 'photo' and 'path' in entry
+        }
+
+    def _carry_over(self, photo_path, photo_conf, previous_photos):
+        """
+        The key and entry of a photo. A photo published in place keeps the
+        key of its last entry, e.g. 'a.JPG' for an 'a.webp' made before
+        sources were kept, and the EXIF it was read from then.
+        """
+        path = './' + str(photo_path.relative_to(CONFIG.DIR_PATH))
+        key, entry = previous_photos.get(path, (photo_path.name, None))
+        if photo_conf.get('path') != path or key == photo_path.name:
+            return photo_path.name, photo_conf
+        return key, {**photo_conf, **{field: entry[field] for field in EXIF_FIELDS if field in entry}}
+
     def _get_album_metadata(self):
         parts = self.path.parts
         return parts[-self.root:] if self.root > 0 else []
 
     def format(self):
+        if self.fingerprint is None:
+            self.scan()
+        if self._unchanged():
+            print(f"Album unchanged: {self.name}")
+            METRICS.count('albums_unchanged')
+            self._keep()
+            return self.previous
+
         print(f"Processing album: {self.name}")
         album_metadata = {
             'name': self.name,
@@ -62,45 +340,87 @@ class Album:
             'parents': self._get_album_metadata()
         }
 
-        image_paths = []
-        sub_album_paths = []
-
-        for entry in self.path.iterdir():
-            if entry.is_dir():
-                sub_album_paths.append(entry)
-            elif self._is_image(entry):
-                image_paths.append(entry)
-
-        photo_list = self._get_sorted_paths(image_paths, 'photo')
-        album_list = self._get_sorted_paths(sub_album_paths, 'album')
+        image_entries, _ = self.entries
+        photo_entries = self._get_sorted_paths(image_entries, 'photo')
+        photo_list = [Path(entry.path) for entry in photo_entries]
+        album_list = [child.path for child in self.children]
+        previous_items = (self.previous or {}).get('items', {}).get('dict', {})
+        previous_photos = self._previous_photos()
 
         has_child_album = False
 
-        for photo_path in photo_list:
-            photo = Photo(photo_path)
-            photo_conf = photo.format()
+        # Queue this album's photos before descending, so the pool keeps
+        # working on them while the sub-albums are walked.
+        photo_results = [
+            self._format_photo(photo_path, entry)
+            for photo_path, entry in zip(photo_list, photo_entries)
+        ]
+        sub_album_confs = []
+        for child in self.children:
+            child.previous = previous_items.get(child.name)
+            sub_album_confs.append(child.format())
+
+        for photo_path, photo_conf in zip(photo_list, photo_results):
+            if isinstance(photo_conf, Future):
+                photo_conf = self._cache_photo(photo_path, photo_conf.result())
             if photo_conf:
-                self.items_order.append(photo_path.name)
-                self.items_dict[photo_path.name] = photo_conf
+                key, photo_conf = self._carry_over(photo_path, photo_conf, previous_photos)
+                self.items_order.append(key)
+                self.items_dict[key] = photo_conf
 
-        for album_path in album_list:
-            sub_album = Album(album_path, album_path.name, self.root + 1)
+        for album_path, sub_album_conf in zip(album_list, sub_album_confs):
             self.items_order.append(album_path.name)
-            self.items_dict[album_path.name] = sub_album.format()
+            self.items_dict[album_path.name] = sub_album_conf
             has_child_album = True
 
         items = {'order': self.items_order, 'dict': self.items_dict}
 
+        if self.cache is not None:
+            if self.changed:
+                # Processed sources are replaced by their outputs
+                self.entries = self._scan()
+            self.fingerprint = self._fingerprint()
+            self.cache.put_album(self.path, self.fingerprint)
+
         if has_child_album:
             return {**album_metadata, 'items': items}
         else:
             # No sub-albums; write config
-            filename = '-'.join(album_metadata['parents']) + '.json'
-            output_path = CONFIG.ALBUMS_PATH / filename
-            print("Writing album config to", output_path)
-            write_json(output_path, items)
+            output_path = self._album_file()
+            relative_path = './' + str(output_path.relative_to(CONFIG.DIR_PATH))
+            self.leaves[relative_path] = write_album_json(output_path, items)
             return {
                 **album_metadata,
-                'path': './' + str(output_path.relative_to(CONFIG.DIR_PATH)),
+                'path': relative_path,
                 'no_sub_album': True
             }
+
+
+def _leaf_paths(album):
+    """The album files of an album config and its sub-albums."""
+    if album.get('no_sub_album'):
+        yield album['path']
+        return
+    for item in album.get('items', {}).get('dict', {}).values():
+        if item.get('type') == 'album':
+            yield from _leaf_paths(item)
+
+
+def _outputs_exist(album):
+    """Whether the album files of an album config and the photo files they list all exist."""
+    if album.get('no_sub_album'):
+        try:
+            with open(CONFIG.DIR_PATH / album['path']) as f:
+                items = json.load(f)
+        except (OSError, ValueError):
+            return False
+    else:
+        items = album.get('items', {})
+    for item in items.get('dict', {}).values():
+        if item.get('type') == 'album' and not _outputs_exist(item):
+            return False
+        if item.get('type') == 'photo':
+            paths = [item[key] for key in ('path', 'min_path') if key in item]
+            if not all(CONFIG.DIR_PATH.joinpath(path).exists() for path in paths):
+                return False
+    return True
@@ -0,0 +1,225 @@
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager, redirect_stdout
+import PIL
+from PIL import Image
+from conf import CONFIG, site_paths, write_json
+from album import Album
+from encode import encode
+from exif import read_header
+from gallery import Gallery
+from nest import Nest
+from photo import Photo
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CAMERAS = [('FUJIFILM', 'X-E2S'), ('SONY', 'ILCE-7M3'), ('Canon', 'EOS R6')]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def make_photo(path, width, height, rng, exif=True):
+    noise = Image.effect_noise((width, height), rng.randint(20, 80))
+    base = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (noise, base, Image.blend(noise, base, 0.5)))
+    if not exif:
+        image.save(path, quality=90)
+        return
+    make, model = rng.choice(CAMERAS)
+    exif_data = Image.Exif()
+    exif_data[0x010F] = make
+    exif_data[0x0110] = model
+    exif_data[0x8769] = {
+        0x829D: rng.choice([1.4, 2.0, 2.8, 5.6]),
+        0x829A: 1 / rng.choice([60, 125, 250, 1000]),
+        0x8827: rng.choice([100, 200, 800, 3200]),
+        0x920A: rng.choice([23.0, 35.0, 50.0]),
+    }
+    image.save(path, quality=90, exif=exif_data)
+
+
+def generate_gallery(photos_path, depth=1, albums=2, photos=5, width=3000, height=2000,
+                     exif=True, seed=0):
+    """
+    Create a synthetic gallery: `albums` sub-albums per level, `depth` levels
+    deep, and `photos` JPEG photos in each album of the last level.
+    """
+    rng = random.Random(seed)
+    level = [photos_path]
+    for d in range(depth):
+        level = [parent / f'album-{d}-{i}' for parent in level for i in range(albums)]
+    count = 0
+    for album_path in level:
+        album_path.mkdir(parents=True, exist_ok=True)
+        for i in range(photos):
+            make_photo(album_path / f'photo-{i:04d}.jpg', width, height, rng, exif)
+            count += 1
+    return count
+
+
+class Timings:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.setdefault(name, []).append(time.perf_counter() - start)
+
+    def summary(self):
+        return {
+            name: {
+                'count': len(times),
+                'total': round(sum(times), 6),
+                'mean': round(sum(times) / len(times), 6),
+                'min': round(min(times), 6),
+                'max': round(max(times), 6),
+            }
+            for name, times in self.stages.items()
+        }
+
+
+def walk(album, timings):
+    with timings.stage('walk'):
+        image_entries, sub_album_entries = album._scan()
+        photo_entries = album._get_sorted_paths(image_entries, 'photo')
+        album_entries = album._get_sorted_paths(sub_album_entries, 'album')
+    photos = [album.path / entry.name for entry in photo_entries]
+    for entry in album_entries:
+        photos += walk(Album(album.path / entry.name, entry.name, album.root + 1), timings)
+    return photos
+
+
+def bench_photos(photo_paths, timings):
+    for path in photo_paths:
+        with timings.stage('photo_init'):
+            photo = Photo(path)
+        with timings.stage('exif'):
+            read_header(path)
+        with timings.stage('decode'):
+            image = photo.pil_image
+        ratio = float(CONFIG.MIN_WIDTH) / photo.size[0]
+        with timings.stage('thumbnail'):
+            min_image = photo.make_thumbnail(tuple(int(x * ratio) for x in photo.size))
+        with timings.stage('watermark'):
+            signed_image = photo.mark_image(image, CONFIG.FONT_SIZE)
+        # Encode next to the source under another name, the source is kept
+        with timings.stage('webp_save'):
+            written = encode(signed_image, path.with_name(path.stem + '.bench' + path.suffix),
+                             CONFIG.ORIGINAL_ENCODING)
+        with timings.stage('webp_save_thumbnail'):
+            written += encode(min_image, path.with_name(path.stem + '.bench.min' + path.suffix),
+                              CONFIG.THUMBNAIL_ENCODING)
+        for output in written:
+            output.unlink()
+
+
+def run(root, depth=1, albums=2, photos=5, width=3000, height=2000, exif=True, seed=0):
+    """
+    Generate a gallery under root and time every stage of a build on it.
+    """
+    # Every file the build reads or writes is under root
+    settings = {
+        **site_paths(root),
+        'CACHE': False,
+        'ALBUM_FILES': 'write',
+    }
+    saved = {name: getattr(CONFIG, name) for name in settings}
+    CONFIG.override(**settings)
+    try:
+        CONFIG.ALBUMS_PATH.mkdir(parents=True, exist_ok=True)
+
+        timings = Timings()
+        start = time.perf_counter()
+        count = generate_gallery(CONFIG.PHOTOS_PATH, depth, albums, photos, width, height, exif, seed)
+        generate_time = time.perf_counter() - start
+
+        photo_paths = walk(Album(CONFIG.PHOTOS_PATH, 'Horcrux', 0), timings)
+        bench_photos(photo_paths, timings)
+
+        gallery = Gallery()
+        with timings.stage('build'):
+            gallery.build()
+        for path, items in gallery.leaves.items():
+            with timings.stage('write_json'):
+                write_json(root / path, items)
+        write_json(CONFIG.HORCRUX_PATH, gallery.tree)
+        with timings.stage('nest'):
+            Nest().main()
+    finally:
+        CONFIG.override(**saved)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+        },
+        'gallery': {
+            'depth': depth, 'albums': albums, 'photos': photos, 'total_photos': count,
+            'width': width, 'height': height, 'exif': exif, 'seed': seed,
+        },
+        'generate_time': round(generate_time, 6),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': timings.summary(),
+    }
+
+
+def compare(results, baseline):
+    print(f"{'stage':<22}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, stage in results['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if old is None:
+            continue
+        ratio = stage['mean'] / old['mean'] if old['mean'] else float('inf')
+        print(f"{name:<22}{old['mean']:>12.4f}{stage['mean']:>12.4f}{ratio:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time each stage of a build on a synthetic gallery.')
+    parser.add_argument('--depth', type=int, default=1, help='levels of nested albums (default: 1)')
+    parser.add_argument('--albums', type=int, default=2, help='sub-albums per level (default: 2)')
+    parser.add_argument('--photos', type=int, default=5, help='photos per album (default: 5)')
+    parser.add_argument('--width', type=int, default=3000, help='photo width (default: 3000)')
+    parser.add_argument('--height', type=int, default=2000, help='photo height (default: 2000)')
+    parser.add_argument('--no-exif', dest='exif', action='store_false', help='write photos without EXIF')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the gallery (default: 0)')
+    parser.add_argument('--output', type=Path, help='write the results as JSON to this file')
+    parser.add_argument('--compare', type=Path, help='results JSON of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    # Keep stdout for the results, the build logs go to stderr
+    with tempfile.TemporaryDirectory(prefix='horcrux-bench-') as tmp, redirect_stdout(sys.stderr):
+        results = run(Path(tmp), args.depth, args.albums, args.photos,
+                      args.width, args.height, args.exif, args.seed)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import json
+import hashlib
+import posixpath
+from conf import CONFIG, atomic_write, published_path
+
+# Settings that change what Photo.format produces for the same source file
+CACHE_SETTINGS = (
+    'MIN_WIDTH',
+    'THUMBNAIL_WIDTHS',
+    'THUMBNAIL_QUALITY',
+    'PLACEHOLDER',
+    'COPYRIGHT',
+    'FONT_SIZE',
+    'FONT_FAMILY',
+    'WATERMARK_ROTATE',
+    'SIGN_THUMBNAIL',
+    'SIGN_ORIGINAL',
+    'ORIGINAL_ENCODING',
+    'THUMBNAIL_ENCODING',
+    'ENCODE_EFFORT',
+)
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """
+    On-disk manifest of processed photos, so unchanged files skip Image.open.
+
+    Each record is keyed by the photo path relative to the repo and holds the
+    source size, mtime, content hash and the entry Photo.format returned.
+    Records are also appended to a log as photos finish, so a build killed
+    before save() still skips them next time.
+
+    The fingerprint of every album is kept as well, by the album path, so
+    unchanged albums are taken from the last build without being formatted.
+    """
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path or CONFIG.CACHE_PATH
+        self.log_path = self.path.with_name(self.path.name + '.log')
+        self.log = None
+        self.records = {}
+        self.seen = set()
+        self.albums = {}
+        self.seen_albums = set()
+        # Albums taken from the last build, their photos are never listed
+        self.kept_albums = set()
+        self.pending = {}
+        # Perceptual hashes of the photos not recorded yet
+        self.phashes = {}
+
+    @staticmethod
+    def settings():
+        return {name: getattr(CONFIG, name) for name in CACHE_SETTINGS}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if data is not None:
+            if data.get('version') == self.VERSION and data.get('settings') == self.settings():
+                self.records = data.get('photos', {})
+                self.albums = data.get('albums', {})
+            else:
+                print('Build cache is outdated, processing every photo again')
+        self._replay()
+        return self
+
+    def _header(self):
+        return {'version': self.VERSION, 'settings': self.settings()}
+
+    def _replay(self):
+        """Add the records logged by a build that didn't reach save()."""
+        try:
+            with open(self.log_path, 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        try:
+            valid = bool(lines) and json.loads(lines[0]) == self._header()
+        except ValueError:
+            valid = False
+        if not valid:
+            self.log_path.unlink()
+            return
+        for line in lines[1:]:
+            try:
+                key, record = json.loads(line)
+            except ValueError:
+                # The last line, cut short by the crash
+                continue
+            if record is None:
+                self.records.pop(key, None)
+            else:
+                self.records[key] = record
+                self.seen.add(key)
+
+    def _append(self, key, record):
+        if self.log is None:
+            self.log = open(self.log_path, 'a')
+            if self.log.tell() == 0:
+                self.log.write(json.dumps(self._header()) + '\n')
+        self.log.write(json.dumps([key, record], separators=(',', ':')) + '\n')
+        self.log.flush()
+
+    def save(self, prune=True):
+        if prune:
+            self.records = {k: v for k, v in self.records.items()
+                            if k in self.seen or posixpath.dirname(k) in self.kept_albums}
+            self.albums = {k: v for k, v in self.albums.items() if k in self.seen_albums}
+        data = {**self._header(), 'photos': self.records, 'albums': self.albums}
+        with atomic_write(self.path) as tmp, open(tmp, 'w') as f:
+            f.write(json.dumps(data, separators=(',', ':')))
+        # Everything logged is in the manifest now
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        self.log_path.unlink(missing_ok=True)
+
+    def _key(self, path):
+        # Kept sources are recorded under the album they are published in
+        return str(published_path(path).relative_to(CONFIG.DIR_PATH))
+
+    def album(self, path):
+        """The fingerprint the album had in the last build, or None."""
+        return self.albums.get(self._key(path))
+
+    def put_album(self, path, fingerprint, kept=False):
+        key = self._key(path)
+        self.seen_albums.add(key)
+        if kept:
+            self.kept_albums.add(key)
+        self.albums[key] = fingerprint
+
+    def get(self, path, stat=None, original=None):
+        """
+        Return the cached entry of an unchanged photo, or None. The entry
+        recorded for a shared duplicate is only returned while the photo is
+        still the duplicate of the same original.
+        """
+        key = self._key(path)
+        self.seen.add(key)
+        stat = stat or path.stat()
+        self.pending[key] = stat
+        record = self.records.get(key)
+        if record is None or record['size'] != stat.st_size:
+            return None
+        if record.get('shared') and (original is None or record['shared'] != self._key(original)):
+            # The entry of another photo, this one has no files of its own
+            return None
+
+        outputs = [record['entry'].get(key) for key in ('path', 'min_path')]
+        if not all(CONFIG.DIR_PATH.joinpath(output).exists() for output in outputs if output):
+            return None
+
+        if record['mtime_ns'] != stat.st_mtime_ns:
+            # Touched but maybe not modified, compare the content
+            if record['hash'] != file_hash(path):
+                return None
+            record['mtime_ns'] = stat.st_mtime_ns
+        return record['entry']
+
+    def phash(self, path, stat):
+        """The perceptual hash recorded for an unmodified photo, or None."""
+        record = self.records.get(self._key(path))
+        if record is None or (record['size'], record['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return record.get('phash')
+
+    def set_phash(self, path, value):
+        key = self._key(path)
+        self.phashes[key] = value
+        if key in self.records:
+            self.records[key]['phash'] = value
+
+    def is_shared(self, path):
+        record = self.records.get(self._key(path))
+        return record is not None and bool(record.get('shared'))
+
+    def put(self, path, entry, original=None):
+        key = self._key(path)
+        self.seen.add(key)
+        stat = self.pending.pop(key, None)
+        if entry is None or stat is None or not path.exists():
+            # Sources replaced by their WebP copy are never listed again
+            if self.records.pop(key, None) is not None:
+                self._append(key, None)
+            return
+        self.records[key] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': file_hash(path),
+            'entry': entry,
+        }
+        if key in self.phashes:
+            self.records[key]['phash'] = self.phashes.pop(key)
+        if original is not None:
+            # The entry is the one of original
+            self.records[key]['shared'] = self._key(original)
+        self._append(key, self.records[key])
@@ -1,24 +1,36 @@
 from types import SimpleNamespace
 from pathlib import Path
+from contextlib import contextmanager
+import os
 import json
-import yaml
+import threading
+from metrics import METRICS
 
 # Core paths
 REPO_DIR = Path.cwd()
 DIR_PATH = Path(__file__).parent.parent
 PHOTOS_PATH = DIR_PATH.joinpath('photos/')
+SOURCES_PATH = DIR_PATH.joinpath('_sources')
 ALBUMS_PATH = DIR_PATH.joinpath('_data/albums')
 HORCRUX_PATH = DIR_PATH.joinpath('_data/Horcrux.json')
 CONFIG_PATH = DIR_PATH.joinpath('_data/config.json')
 CONF_YAML_PATH = DIR_PATH.joinpath('_config.yml')
-
-# Ensure albums path exists
-ALBUMS_PATH.mkdir(parents=True, exist_ok=True)
+CACHE_PATH = DIR_PATH.joinpath('_data/.horcrux-cache')
+METRICS_PATH = DIR_PATH.joinpath('_data/.horcrux-metrics.json')
+JOURNAL_PATH = DIR_PATH.joinpath('_data/.horcrux-journal')
+FONTS_PATH = DIR_PATH.joinpath('assets/font')
+PAGES_DATA_PATH = DIR_PATH.joinpath('_data/pages')
+PAGES_SITE_PATH = DIR_PATH.joinpath('gallery')
 
 # Default config values
 DEFAULT_CONFIG = {
     'DEBUG': False,
     'MIN_WIDTH': 600,
+    'THUMBNAIL_WIDTHS': [],
+    'THUMBNAIL_QUALITY': 'exact',
+    'PLACEHOLDER': True,
+    'DUPLICATES': False,
+    'DUPLICATE_DISTANCE': 4,
     'COPYRIGHT': '@im_kveen',
     'FONT_SIZE': 40,
     'FONT_FAMILY': 'Eczar-Medium.ttf',
@@ -32,83 +44,283 @@ DEFAULT_CONFIG = {
     'REVERSE_PHOTOS_ORDER': True,
     'ORDER_PHOTOS_BY_LAST_DO': 'access',
     'KEEP_ORDER': False,
+    'WORKERS': 1,
+    'PIPELINE': False,
+    'MEMORY_BUDGET': 0,
+    'CACHE': True,
+    'ALBUM_FILES': 'write',
+    'OUTPUT': 'single',
+    'PAGE_SIZE': 100,
+    'MASONRY': False,
+    'LAYOUT_COLUMNS': [3, 2],
+    'ENCODE_EFFORT': 'default',
+    'ORIGINAL_ENCODING': {'formats': ['webp'], 'quality': 95, 'lossless': False},
+    'THUMBNAIL_ENCODING': {'formats': ['webp'], 'quality': 95, 'lossless': False},
 
     # Paths in config for unified access
     'REPO_DIR': REPO_DIR,
     'DIR_PATH': DIR_PATH,
     'PHOTOS_PATH': PHOTOS_PATH,
+    'SOURCES_PATH': SOURCES_PATH,
     'ALBUMS_PATH': ALBUMS_PATH,
     'HORCRUX_PATH': HORCRUX_PATH,
     'CONFIG_PATH': CONFIG_PATH,
     'CONF_YAML_PATH': CONF_YAML_PATH,
+    'CACHE_PATH': CACHE_PATH,
+    'METRICS_PATH': METRICS_PATH,
+    'JOURNAL_PATH': JOURNAL_PATH,
+    'FONTS_PATH': FONTS_PATH,
+    'PAGES_DATA_PATH': PAGES_DATA_PATH,
+    'PAGES_SITE_PATH': PAGES_SITE_PATH,
 }
 
-# Load and apply _config.yml values
-with open(CONF_YAML_PATH, 'r') as config_file:
-    site_conf = yaml.load(config_file, Loader=yaml.FullLoader)
-
-DEFAULT_CONFIG['COPYRIGHT'] = '@' + site_conf.get('instagram', 'unknown')
-
-process = site_conf.get('process', {})
-album_conf = process.get('album', {})
-photo_conf = process.get('photo', {})
-watermark_conf = photo_conf.get('watermark', {})
-
-DEFAULT_CONFIG.update({
-    'MIN_WIDTH': photo_conf.get('min_width', DEFAULT_CONFIG['MIN_WIDTH']),
-    'FONT_SIZE': watermark_conf.get('fontsize', DEFAULT_CONFIG['FONT_SIZE']),
-    'FONT_FAMILY': watermark_conf.get('fontfamily', DEFAULT_CONFIG['FONT_FAMILY']),
-    'WATERMARK_ROTATE': watermark_conf.get('rotate', DEFAULT_CONFIG['WATERMARK_ROTATE']),
-    'SIGN_THUMBNAIL': watermark_conf.get('thumbnail', DEFAULT_CONFIG['SIGN_THUMBNAIL']),
-    'SIGN_ORIGINAL': watermark_conf.get('original', DEFAULT_CONFIG['SIGN_ORIGINAL']),
-    'SORT_ALBUMS_BY_TIME': album_conf.get('sort_by_time', DEFAULT_CONFIG['SORT_ALBUMS_BY_TIME']),
-    'REVERSE_ALBUMS_ORDER': album_conf.get('reverse', DEFAULT_CONFIG['REVERSE_ALBUMS_ORDER']),
-    'ORDER_ALBUMS_BY_LAST_DO': album_conf.get('order_by', DEFAULT_CONFIG['ORDER_ALBUMS_BY_LAST_DO']),
-    'SORT_PHOTOS_BY_TIME': photo_conf.get('sort_by_time', DEFAULT_CONFIG['SORT_PHOTOS_BY_TIME']),
-    'REVERSE_PHOTOS_ORDER': photo_conf.get('reverse', DEFAULT_CONFIG['REVERSE_PHOTOS_ORDER']),
-    'ORDER_PHOTOS_BY_LAST_DO': photo_conf.get('order_by', DEFAULT_CONFIG['ORDER_PHOTOS_BY_LAST_DO']),
-    'KEEP_ORDER': process.get('keep_order', DEFAULT_CONFIG['KEEP_ORDER']),
-})
+
+def site_paths(root):
+    """
+    The paths of the files a build reads and writes, for a site at root,
+    e.g. to build another gallery than this one.
+    """
+    return {
+        'DIR_PATH': root,
+        'PHOTOS_PATH': root / 'photos',
+        'SOURCES_PATH': root / '_sources',
+        'ALBUMS_PATH': root / '_data/albums',
+        'HORCRUX_PATH': root / '_data/Horcrux.json',
+        'CONFIG_PATH': root / '_data/config.json',
+        'CACHE_PATH': root / '_data/.horcrux-cache',
+        'METRICS_PATH': root / '_data/.horcrux-metrics.json',
+        'JOURNAL_PATH': root / '_data/.horcrux-journal',
+        'PAGES_DATA_PATH': root / '_data/pages',
+        'PAGES_SITE_PATH': root / 'gallery',
+    }
+
+
+def read_site_conf(path):
+    """
+    Map the values of _config.yml to config names.
+    """
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path, 'r') as config_file:
+        site_conf = yaml.load(config_file, Loader=loader) or {}
+
+    process = site_conf.get('process', {})
+    album_conf = process.get('album', {})
+    photo_conf = process.get('photo', {})
+    watermark_conf = photo_conf.get('watermark', {})
+    encode_conf = process.get('encode', {})
+    # Column counts of the page layout, for wide then small screens
+    columns = [site_conf.get('column'), site_conf.get('small_screen', {}).get('column')]
+
+    values = {
+        'COPYRIGHT': '@' + site_conf.get('instagram', 'unknown'),
+        'MIN_WIDTH': photo_conf.get('min_width'),
+        'THUMBNAIL_WIDTHS': photo_conf.get('widths'),
+        'THUMBNAIL_QUALITY': photo_conf.get('thumbnail_quality'),
+        'PLACEHOLDER': photo_conf.get('placeholder'),
+        'DUPLICATES': photo_conf.get('duplicates'),
+        'DUPLICATE_DISTANCE': photo_conf.get('duplicate_distance'),
+        'FONT_SIZE': watermark_conf.get('fontsize'),
+        'FONT_FAMILY': watermark_conf.get('fontfamily'),
+        'WATERMARK_ROTATE': watermark_conf.get('rotate'),
+        'SIGN_THUMBNAIL': watermark_conf.get('thumbnail'),
+        'SIGN_ORIGINAL': watermark_conf.get('original'),
+        'SORT_ALBUMS_BY_TIME': album_conf.get('sort_by_time'),
+        'REVERSE_ALBUMS_ORDER': album_conf.get('reverse'),
+        'ORDER_ALBUMS_BY_LAST_DO': album_conf.get('order_by'),
+        'SORT_PHOTOS_BY_TIME': photo_conf.get('sort_by_time'),
+        'REVERSE_PHOTOS_ORDER': photo_conf.get('reverse'),
+        'ORDER_PHOTOS_BY_LAST_DO': photo_conf.get('order_by'),
+        'KEEP_ORDER': process.get('keep_order'),
+        'WORKERS': process.get('workers'),
+        'PIPELINE': process.get('pipeline'),
+        'MEMORY_BUDGET': process.get('memory_budget'),
+        'CACHE': process.get('cache'),
+        'ALBUM_FILES': process.get('album_files'),
+        'OUTPUT': process.get('output'),
+        'PAGE_SIZE': process.get('page_size'),
+        'MASONRY': process.get('masonry'),
+        'LAYOUT_COLUMNS': [n for n in columns if n] or None,
+        'ENCODE_EFFORT': encode_conf.get('effort'),
+    }
+    for target in ('original', 'thumbnail'):
+        if target in encode_conf:
+            name = target.upper() + '_ENCODING'
+            values[name] = {**DEFAULT_CONFIG[name], **encode_conf[target]}
+    return {name: value for name, value in values.items() if value is not None}
+
+
+class Config(SimpleNamespace):
+    """
+    Attribute-style access to DEFAULT_CONFIG and _config.yml.
+
+    The YAML file is only read when a value is first needed. Values set
+    before that, e.g. from the command line, take precedence over it.
+    """
+    def __init__(self, yaml_path=CONF_YAML_PATH):
+        super().__init__()
+        self.__dict__['_yaml_path'] = yaml_path
+        self.__dict__['_loaded'] = False
+
+    def load(self):
+        if not self._loaded:
+            values = {**DEFAULT_CONFIG, **read_site_conf(self._yaml_path)}
+            for name, value in values.items():
+                self.__dict__.setdefault(name, value)
+            self.__dict__['_loaded'] = True
+        return self
+
+    def __getattr__(self, name):
+        # Only called for values not set yet
+        if name.startswith('_') or self.__dict__.get('_loaded'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def override(self, **values):
+        """Set the given values, skipping the ones left to None."""
+        for name, value in values.items():
+            if value is not None:
+                setattr(self, name, value)
+
+    def settings(self):
+        """All the values, e.g. to hand them to another process."""
+        self.load()
+        return {name: value for name, value in vars(self).items() if not name.startswith('_')}
+
 
 # Enable attribute-style access everywhere
-CONFIG = SimpleNamespace(**DEFAULT_CONFIG)
+CONFIG = Config()
 
 # --- Utility functions ---
 
 def merge_list(list_keep_order, list_new) -> list:
-    print('Merge old order:', list_keep_order)
-    print('The new order is:', list_new)
-    right = None
-    left = None
-    for item in list_keep_order:
-        if item in list_new:
-            idx = list_new.index(item)
-            if left is None or idx < left:
-                left = idx
-            if right is None or idx > right:
-                right = idx
-
-    if left is not None and right is not None and (right - left + 1) == len(list_keep_order):
-        list_new[left:right + 1] = list_keep_order
-
-    print('Merged order:', list_new)
+    """
+    Keep the manual order of the items still present, and put each new item
+    right after the item it follows in list_new (or first if none).
+    """
+    new_items = set(list_new)
+    kept = [item for item in dict.fromkeys(list_keep_order) if item in new_items]
+    kept_items = set(kept)
+
+    inserted_after = {}
+    anchor = None
+    for item in list_new:
+        if item in kept_items:
+            anchor = item
+        else:
+            inserted_after.setdefault(anchor, []).append(item)
+
+    merged = inserted_after.get(None, [])
+    for item in kept:
+        merged.append(item)
+        merged.extend(inserted_after.get(item, ()))
+
+    list_new[:] = merged
     return list_new
 
+def merge_order(original, data):
+    """
+    Apply the kept order of original to data, for the album itself and its
+    nested albums.
+    """
+    if not isinstance(original, dict) or not isinstance(data, dict):
+        return
+    if 'order' in original and 'order' in data:
+        data['order'] = merge_list(original['order'], data['order'])
+    if 'items' in original and 'items' in data:
+        merge_order(original['items'], data['items'])
+    if 'dict' in original and 'dict' in data:
+        for key, child in data['dict'].items():
+            merge_order(original['dict'].get(key), child)
+
 def merge_json(path, data):
     try:
         with open(path, 'r') as f:
             original_config = json.load(f)
-            if 'items' in original_config and 'items' in data:
-                data['items']['order'] = merge_list(original_config['items']['order'], data['items']['order'])
-            if 'order' in original_config:
-                data['order'] = merge_list(original_config['order'], data['order'])
-    except Exception:
-        pass
+    except (OSError, ValueError):
+        return data
+    merge_order(original_config, data)
     return data
 
+def stored_path(path):
+    """Where a photo under PHOTOS_PATH is kept as a source, None elsewhere."""
+    try:
+        return CONFIG.SOURCES_PATH / path.relative_to(CONFIG.PHOTOS_PATH)
+    except ValueError:
+        return None
+
+def published_path(path):
+    """Where a kept source is published under PHOTOS_PATH, other paths as is."""
+    try:
+        return CONFIG.PHOTOS_PATH / path.relative_to(CONFIG.SOURCES_PATH)
+    except ValueError:
+        return path
+
+def relative_path(path):
+    """path relative to CONFIG.DIR_PATH, for messages. A path outside of it is shown as it is."""
+    try:
+        return str(path.relative_to(CONFIG.DIR_PATH))
+    except ValueError:
+        return str(path)
+
+def temp_path(path):
+    """A hidden temporary file next to path, unique to this thread."""
+    return path.with_name(f'.{path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+
+@contextmanager
+def atomic_write(path):
+    """
+    Yield a temporary path to write to, moved over path once the block
+    succeeds, so path is never left half-written.
+    """
+    tmp = temp_path(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+
+def dump_json(path, data):
+    with METRICS.stage('json'), atomic_write(path) as tmp, open(tmp, 'w') as f:
+        f.write(json.dumps(data, indent=2, separators=(',', ': ')))
+
 def write_json(path, data):
     if CONFIG.KEEP_ORDER:
         data = merge_json(path, data)
-    with open(path, 'w') as f:
-        f.write(json.dumps(data, indent=2, separators=(',', ': ')))
-        
\ No newline at end of file
+    dump_json(path, data)
+    return data
+
+# Background writer for the intermediate album files
+_json_writer = None
+_pending_writes = []
+
+def write_album_json(path, data):
+    """
+    Write an intermediate file (album JSON, Horcrux.json) as set by
+    process.album_files: 'write', 'async' or 'skip'. The data is merged
+    with the kept order either way and returned for the in-memory build.
+    """
+    global _json_writer
+    if CONFIG.KEEP_ORDER:
+        data = merge_json(path, data)
+    if CONFIG.ALBUM_FILES == 'skip':
+        return data
+    print('Writing album config to', path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if CONFIG.ALBUM_FILES == 'async':
+        if _json_writer is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _json_writer = ThreadPoolExecutor(max_workers=1)
+        _pending_writes.append(_json_writer.submit(dump_json, path, data))
+    else:
+        dump_json(path, data)
+    return data
+
+def flush_json():
+    """Wait for the background album writes, raising the first failure."""
+    while _pending_writes:
+        _pending_writes.pop(0).result()
@@ -0,0 +1,135 @@
+from pathlib import Path
+from conf import CONFIG, relative_path
+from metrics import METRICS
+
+# Side of the difference hash, 8 gives 64 bits
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def dhash(path):
+    """
+    The difference hash of a photo, as 16 hex digits: whether each pixel
+    of a 9x8 grayscale copy is brighter than its right neighbour. JPEGs are
+    decoded straight to grayscale at a fraction of their size.
+    """
+    from PIL import Image
+    with Image.open(path) as image:
+        image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            value = value << 1 | (row[x] > row[x + 1])
+    return f'{value:016x}'
+
+
+class Duplicates:
+    """
+    Perceptual hashes of the photos of the gallery, to find the same shot
+    exported to several albums.
+
+    The first copy met in the order albums are formatted is the original,
+    later copies within CONFIG.DUPLICATE_DISTANCE bits of it are its
+    duplicates. With CONFIG.DUPLICATES 'share', a duplicate gets the entry
+    of its original, so its files are made and published once.
+    """
+    def __init__(self, cache=None, distance=None):
+        self.cache = cache
+        self.distance = CONFIG.DUPLICATE_DISTANCE if distance is None else distance
+        self.hashes = {}
+        # Duplicate path: (original path, distance)
+        self.originals = {}
+        # Entries, or futures of them, of the originals formatted in this run
+        self.entries = {}
+        # Two hashes within distance bits have at least one chunk in common
+        chunks = self.distance + 1
+        self.chunk_bits = -(-HASH_BITS // chunks)
+        self.buckets = [{} for _ in range(chunks)]
+
+    @property
+    def sharing(self):
+        return CONFIG.DUPLICATES == 'share'
+
+    def index(self, album):
+        """Hash the photos of album and its sub-albums, the album being scanned."""
+        for path, stat in _photos(album):
+            if path in self.hashes:
+                continue
+            value = self._hash(path, stat)
+            if value is not None:
+                self._add(path, value)
+        return self
+
+    def _hash(self, path, stat):
+        value = self.cache.phash(path, stat) if self.cache is not None else None
+        if value is None:
+            try:
+                with METRICS.stage('phash', path):
+                    value = dhash(path)
+            except OSError as e:
+                print(f"Failed to hash {path}: {e}")
+                return None
+            if self.cache is not None:
+                self.cache.set_phash(path, value)
+        return int(value, 16)
+
+    def _add(self, path, value):
+        self.hashes[path] = value
+        match = None
+        for i, bucket in enumerate(self.buckets):
+            for original in bucket.get(self._chunk(value, i), ()):
+                distance = bin(value ^ self.hashes[original]).count('1')
+                if distance <= self.distance and (match is None or distance < match[1]):
+                    match = (original, distance)
+        if match is not None:
+            self.originals[path] = match
+            METRICS.count('duplicates')
+            print(f"Duplicate: {relative_path(path)} of {relative_path(match[0])}"
+                  + (f" ({match[1]} bits apart)" if match[1] else ''))
+            return
+        # Only originals are matched against, so every copy is compared to the first
+        for i, bucket in enumerate(self.buckets):
+            bucket.setdefault(self._chunk(value, i), []).append(path)
+
+    def _chunk(self, value, i):
+        return (value >> (i * self.chunk_bits)) & ((1 << self.chunk_bits) - 1)
+
+    def register(self, path, entry):
+        """Keep the entry of an original, for its duplicates formatted later."""
+        if path not in self.originals:
+            self.entries[path] = entry
+
+    def shared(self, path):
+        """
+        The entry, or future of it, of the original of a duplicate when
+        sharing, else None.
+        """
+        original = self.original(path)
+        if original is None:
+            return None
+        entry = self.entries.get(original)
+        if entry is None and self.cache is not None:
+            # Its album was taken from the last build as is
+            entry = self.cache.get(original)
+        return entry
+
+    def original(self, path):
+        """The path of the original of a duplicate when sharing, else None."""
+        if not self.sharing or path not in self.originals:
+            return None
+        return self.originals[path][0]
+
+    def is_shared(self, path):
+        return self.original(path) is not None
+
+
+def _photos(album):
+    """The photos of album and its sub-albums, in the order format() takes them."""
+    for entry in album._get_sorted_paths(album.entries[0], 'photo'):
+        yield Path(entry.path), entry.stat()
+    for child in album.children:
+        yield from _photos(child)
+
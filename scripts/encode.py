@@ -0,0 +1,133 @@
+import io
+from functools import lru_cache
+from conf import CONFIG, atomic_write, temp_path
+
+# Output formats: file suffix, Pillow format name and the feature it needs
+FORMATS = {
+    'webp': ('.webp', 'WEBP', 'webp'),
+    'avif': ('.avif', 'AVIF', 'avif'),
+    'jpeg': ('.jpg', 'JPEG', None),
+}
+
+# Encoder settings of each effort tier, trading encode time for file size
+EFFORT = {
+    'fast': {
+        'webp': {'method': 0},
+        'avif': {'speed': 9},
+        'jpeg': {},
+    },
+    'default': {
+        'webp': {'method': 4},
+        'avif': {'speed': 6},
+        'jpeg': {'optimize': True},
+    },
+    'max': {
+        'webp': {'method': 6},
+        'avif': {'speed': 2},
+        'jpeg': {'optimize': True, 'progressive': True},
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def output_formats(formats):
+    """
+    The formats in the given tuple this Pillow build can write, in order.
+    Falls back to WebP when none of them can be written.
+    """
+    from PIL import features
+    usable = []
+    for name in formats:
+        if name not in FORMATS:
+            print(f"Unknown output format '{name}', expected one of {', '.join(FORMATS)}")
+        elif FORMATS[name][2] and not features.check(FORMATS[name][2]):
+            print(f"Pillow cannot write {name.upper()} here, skipping it")
+        elif name not in usable:
+            usable.append(name)
+    return tuple(usable) or ('webp',)
+
+
+def formats_of(encoding):
+    return output_formats(tuple(encoding.get('formats', ('webp',))))
+
+
+def output_path(path, name):
+    """Where path is written as the given format."""
+    suffix = FORMATS[name][0]
+    # Re-encoding a JPEG as JPEG keeps its name, e.g. '.JPG' or '.jpeg'
+    if name == 'jpeg' and path.suffix.lower() in ('.jpg', '.jpeg'):
+        return path
+    return path.with_suffix(suffix)
+
+
+def source_format(path):
+    """The output format a file already is in, from its suffix, or None."""
+    suffix = path.suffix.lower()
+    if suffix in ('.jpg', '.jpeg'):
+        return 'jpeg'
+    for name, (format_suffix, _, _) in FORMATS.items():
+        if suffix == format_suffix:
+            return name
+    return None
+
+
+def save_options(name, encoding, effort=None):
+    """The Pillow save() arguments of a format for encoding and an effort tier."""
+    options = dict(EFFORT[effort or CONFIG.ENCODE_EFFORT][name])
+    quality = encoding.get('quality', 95)
+    lossless = encoding.get('lossless', False)
+    if name == 'webp':
+        # For lossless WebP, quality is the compression effort
+        options.update(quality=quality, lossless=lossless)
+    elif name == 'avif':
+        options.update(quality=100 if lossless else quality)
+        if lossless:
+            options['subsampling'] = '4:4:4'
+    else:
+        # JPEG has no lossless mode
+        options.update(quality=quality)
+    return options
+
+
+def encode(img, path, encoding, staged=False):
+    """
+    Write img once per output format of encoding, next to path.
+
+    The image is converted once and shared by all the encoders. Returns
+    the written paths, the first one being the primary format. When
+    staged, the files are left under their temporary names, for the caller
+    to commit, and (temporary path, path) pairs are returned.
+    """
+    rgb = img if img.mode == 'RGB' else img.convert('RGB')
+    written = []
+    try:
+        for name in formats_of(encoding):
+            target = output_path(path, name)
+            if staged:
+                tmp = temp_path(target)
+                written.append((tmp, target))
+                rgb.save(tmp, FORMATS[name][1], **save_options(name, encoding))
+            else:
+                with atomic_write(target) as tmp:
+                    rgb.save(tmp, FORMATS[name][1], **save_options(name, encoding))
+                written.append(target)
+    except BaseException:
+        if staged:
+            for tmp, _ in written:
+                tmp.unlink(missing_ok=True)
+        raise
+    return written
+
+
+def encode_bytes(img, path, encoding):
+    """
+    Like encode, but keep the files in memory, for the pipeline's writer.
+    Returns (path, data) pairs.
+    """
+    rgb = img if img.mode == 'RGB' else img.convert('RGB')
+    outputs = []
+    for name in formats_of(encoding):
+        buffer = io.BytesIO()
+        rgb.save(buffer, FORMATS[name][1], **save_options(name, encoding))
+        outputs.append((output_path(path, name), buffer.getvalue()))
+    return outputs
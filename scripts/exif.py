@@ -0,0 +1,156 @@
+import io
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# The EXIF tags Photo uses, by tag id
+TAGS = {
+    0x010F: 'Make',
+    0x0110: 'Model',
+    0x829A: 'ExposureTime',
+    0x829D: 'FNumber',
+    0x8827: 'ISOSpeedRatings',
+    0x9003: 'DateTimeOriginal',
+    0x920A: 'FocalLength',
+}
+EXIF_IFD = 0x8769
+
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+
+# TIFF field types: struct format and size of one value
+TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('L', 4), 5: ('LL', 8), 7: ('s', 1),
+    9: ('l', 4), 10: ('ll', 8), 11: ('f', 4), 12: ('d', 8),
+}
+
+# Start of frame markers, which hold the image size
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_header(source):
+    """
+    Read the size and the whitelisted EXIF tags of a JPEG, from a path or
+    its content, without decoding it or creating a PIL image. Only the
+    segments before the image data are read.
+
+    Return (size, tags), or None when the file is not a JPEG this reader
+    understands, so the caller can fall back to Pillow.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return _read_jpeg(io.BytesIO(source))
+    try:
+        with open(source, 'rb') as f:
+            return _read_jpeg(f)
+    except OSError:
+        return None
+
+
+def read_headers(paths, workers=8):
+    """Read many headers at once, mapping each path to read_header's result."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(read_header, paths)))
+
+
+def read_directory(path, workers=8):
+    """read_headers for the JPEG files of a directory, by file name."""
+    with os.scandir(path) as it:
+        paths = [entry.path for entry in it
+                 if entry.is_file() and os.path.splitext(entry.name)[1].lower() in JPEG_EXTENSIONS]
+    return {os.path.basename(path): header for path, header in read_headers(paths, workers).items()}
+
+
+def _read_jpeg(f):
+    if f.read(2) != b'\xff\xd8':
+        return None
+    tags = {}
+    found_exif = False
+    try:
+        while True:
+            byte = f.read(1)
+            if byte != b'\xff':
+                return None
+            marker = f.read(1)
+            # Skip fill bytes
+            while marker == b'\xff':
+                marker = f.read(1)
+            if not marker:
+                return None
+            marker = marker[0]
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                continue
+            if marker in (0xD9, 0xDA):
+                # End of image or start of the image data, before any frame
+                return None
+            length = struct.unpack('>H', f.read(2))[0]
+            payload = f.read(length - 2)
+            if len(payload) != length - 2:
+                return None
+            if marker == 0xE1 and not found_exif and payload.startswith(b'Exif\x00\x00'):
+                found_exif = True
+                tags = _read_tiff(payload[6:])
+            elif marker in SOF_MARKERS:
+                height, width = struct.unpack('>HH', payload[1:5])
+                return (width, height), tags
+    except (struct.error, IndexError, ValueError):
+        return None
+
+
+def _read_tiff(data):
+    if data[:2] == b'II':
+        order = '<'
+    elif data[:2] == b'MM':
+        order = '>'
+    else:
+        return {}
+    tags = {}
+    offset = struct.unpack(order + 'L', data[4:8])[0]
+    pointers = _read_ifd(data, offset, order, tags)
+    if EXIF_IFD in pointers:
+        _read_ifd(data, pointers[EXIF_IFD], order, tags)
+    return tags
+
+
+def _read_ifd(data, offset, order, tags):
+    """
+    Add the whitelisted tags of the IFD at offset to tags, return the
+    offsets of its sub-IFDs.
+    """
+    pointers = {}
+    count = struct.unpack(order + 'H', data[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, type_, n = struct.unpack(order + 'HHL', data[entry:entry + 8])
+        if tag == EXIF_IFD:
+            pointers[tag] = struct.unpack(order + 'L', data[entry + 8:entry + 12])[0]
+        elif tag in TAGS and type_ in TYPES:
+            tags[TAGS[tag]] = _read_value(data, entry, order, type_, n)
+    return pointers
+
+
+def _read_value(data, entry, order, type_, n):
+    """
+    The value of an IFD entry as Photo uses it: rationals as floats, or
+    None when undefined (zero denominator), strings like Pillow decodes them.
+    """
+    fmt, size = TYPES[type_]
+    start = entry + 8
+    if size * n > 4:
+        start = struct.unpack(order + 'L', data[start:start + 4])[0]
+    raw = data[start:start + size * n]
+    if len(raw) != size * n:
+        raise ValueError('truncated EXIF value')
+
+    if type_ == 2:
+        if raw.endswith(b'\x00'):
+            raw = raw[:-1]
+        return raw.decode('latin-1', 'replace')
+    if type_ == 7:
+        return raw
+
+    values = struct.unpack(order + fmt * n, raw)
+    if type_ in (5, 10):
+        values = tuple(
+            numerator / denominator if denominator else None
+            for numerator, denominator in zip(values[::2], values[1::2])
+        )
+    return values[0] if n == 1 else values
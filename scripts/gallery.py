@@ -0,0 +1,120 @@
+import json
+from album import Album, _leaf_paths
+from duplicates import Duplicates
+from nest import Nest
+from conf import CONFIG, write_album_json, flush_json, published_path
+import journal
+
+
+class Gallery:
+    """
+    The album tree of CONFIG.PHOTOS_PATH and the config files generated from it.
+    """
+    def __init__(self, pool=None, cache=None):
+        self.pool = pool
+        self.cache = cache
+        self.tree = None
+        self.leaves = {}
+        self.duplicates = Duplicates(cache) if CONFIG.DUPLICATES else None
+
+    def _album(self, path, previous=None):
+        parts = path.relative_to(CONFIG.PHOTOS_PATH).parts
+        name = parts[-1] if parts else 'Horcrux'
+        return Album(path, name, len(parts), self.pool, self.cache, self.leaves, previous, self.duplicates)
+
+    def _previous(self):
+        """The album tree of the last build, to reuse its unchanged albums."""
+        if self.tree is not None:
+            return self.tree
+        if self.cache is None:
+            return None
+        try:
+            with open(CONFIG.HORCRUX_PATH, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _node(self, path):
+        node = self.tree
+        for part in path.relative_to(CONFIG.PHOTOS_PATH).parts:
+            node = node.get('items', {}).get('dict', {}).get(part)
+            if node is None:
+                return None
+        return node
+
+    def _resort(self, path):
+        """
+        Sort the children of an album again, sub-albums sorted by time move
+        when their content changes.
+        """
+        node = self._node(path)
+        album = self._album(path)
+        image_entries, sub_album_entries = album._scan()
+        children = node['items']['dict']
+        node['items']['order'] = [
+            entry.name
+            for entry in (album._get_sorted_paths(image_entries, 'photo')
+                          + album._get_sorted_paths(sub_album_entries, 'album'))
+            if entry.name in children
+        ]
+
+    def _prune(self, previous, tree):
+        """Delete the album files of the albums in previous and no longer in tree."""
+        for path in set(_leaf_paths(previous)) - set(_leaf_paths(tree)):
+            print(f"Removing album config: {path}")
+            self.leaves.pop(path, None)
+            CONFIG.DIR_PATH.joinpath(path).unlink(missing_ok=True)
+
+    def _format(self, album):
+        album.scan()
+        if self.duplicates is not None:
+            # Every photo is hashed before any is formatted
+            self.duplicates.index(album)
+        return album.format()
+
+    def build(self):
+        journal.begin()
+        previous = self._previous()
+        self.tree = self._format(self._album(CONFIG.PHOTOS_PATH, previous))
+        if previous is not None:
+            self._prune(previous, self.tree)
+
+    def update(self, paths):
+        """
+        Format again only the albums containing the changed paths, kept
+        sources counting for the album they are published in.
+        """
+        journal.begin()
+        dirs = set()
+        for path in paths:
+            path = published_path(path).parent
+            while not path.is_dir():
+                path = path.parent
+            dirs.add(path)
+        # Formatting an album covers its sub-albums
+        roots = [d for d in dirs if not any(p in dirs for p in d.parents)]
+
+        for root in sorted(roots):
+            parent = self._node(root.parent) if root != CONFIG.PHOTOS_PATH else None
+            if parent is None or root.name not in parent.get('items', {}).get('dict', {}):
+                self.build()
+                return
+            print(f"Updating album: {root.relative_to(CONFIG.PHOTOS_PATH)}")
+            items = parent['items']['dict']
+            previous = items[root.name]
+            items[root.name] = self._format(self._album(root, previous))
+            self._prune(previous, items[root.name])
+            for ancestor in root.parents:
+                self._resort(ancestor)
+                if ancestor == CONFIG.PHOTOS_PATH:
+                    break
+
+    def write(self):
+        config = write_album_json(CONFIG.HORCRUX_PATH, self.tree)
+        Nest(self.leaves).main(config)
+        flush_json()
+        # Saved last: the album fingerprints must not get ahead of the files
+        if self.cache is not None:
+            self.cache.save()
+        # Every photo is committed and listed, nothing left to recover
+        journal.clear()
@@ -0,0 +1,116 @@
+import os
+import re
+import json
+from conf import CONFIG
+from metrics import METRICS
+
+# The names conf.temp_path gives
+TEMP_NAME = re.compile(r'^\..+\.\d+-\d+\.tmp$')
+
+
+def _append(record, sync=False):
+    # One write to a file opened for appending, so lines from several
+    # worker processes don't interleave
+    line = (json.dumps(record) + '\n').encode()
+    fd = os.open(CONFIG.JOURNAL_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def begin():
+    """
+    Start the journal of a build, so a build killed before its first
+    commit still leaves its temporary files to recover().
+    """
+    _append({'begin': os.getpid()})
+
+
+def commit(photo, renames, deletes):
+    """
+    Move the temporary outputs of photo in place, then delete its sources.
+
+    The operations are journaled first: if the build is killed halfway
+    through them, recover() finishes them on the next run, so a photo is
+    never left with its source deleted but its outputs missing, nor
+    watermarked twice.
+    """
+    record = {
+        'photo': str(photo),
+        'renames': [(str(tmp), str(path)) for tmp, path in renames],
+        'deletes': [str(path) for path in deletes],
+    }
+    _append(record, sync=True)
+    _apply(record, photo)
+    _append({'done': record['photo']})
+
+
+def _apply(record, photo=None):
+    for tmp, path in record['renames']:
+        # Already moved when finishing an interrupted commit
+        if os.path.exists(tmp):
+            os.replace(tmp, path)
+    for path in record['deletes']:
+        try:
+            with METRICS.stage('delete', photo):
+                os.unlink(path)  # Deletes the original file
+            print(f"Deleted original: {path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Failed to delete original: {path} — {e}")
+
+
+def recover():
+    """
+    Finish the commits a killed build left halfway and delete the
+    temporary files it didn't get to commit, then start a new journal.
+    Return the number of photos finished.
+    """
+    try:
+        with open(CONFIG.JOURNAL_PATH, 'r') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return 0
+
+    pending = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # The last line, cut short by the crash
+            continue
+        if 'done' in record:
+            pending.pop(record['done'], None)
+        elif 'photo' in record:
+            pending[record['photo']] = record
+
+    for record in pending.values():
+        print(f"Finishing the interrupted photo: {record['photo']}")
+        _apply(record)
+    _remove_temp_files()
+    clear()
+    return len(pending)
+
+
+def _remove_temp_files():
+    """Delete the temporary files left in the photos and the data folders."""
+    folders = [(CONFIG.PHOTOS_PATH, True), (CONFIG.ALBUMS_PATH, False), (CONFIG.HORCRUX_PATH.parent, False)]
+    for folder, recursive in folders:
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                if TEMP_NAME.match(name):
+                    os.unlink(os.path.join(root, name))
+                    print(f"Deleted unfinished file: {os.path.join(root, name)}")
+            if not recursive:
+                break
+
+
+def clear():
+    try:
+        os.unlink(CONFIG.JOURNAL_PATH)
+    except FileNotFoundError:
+        pass
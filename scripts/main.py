@@ -1,7 +1,12 @@
 import sys
-from album import Album
-from nest import Nest
-from conf import CONFIG,write_json
+import argparse
+from contextlib import nullcontext
+from gallery import Gallery
+from watch import Watcher
+from cache import BuildCache
+from metrics import METRICS
+from conf import CONFIG
+import journal
 
 class bcolors:
     HEADER = '\033[95m'
@@ -20,14 +25,82 @@ class log():
     def ok(text):
         print(bcolors.OKBLUE + text + bcolors.ENDC)
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Process photos and generate the gallery config.')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='number of processes used for photos, 0 for one per core '
+                             '(default: process.workers in _config.yml)')
+    parser.add_argument('--pipeline', action='store_true', default=None,
+                        help='overlap reading, processing and writing photos in threads, '
+                             'with --workers processing threads (default: process.pipeline in _config.yml)')
+    parser.add_argument('--memory-budget', type=float, metavar='MP',
+                        help='megapixels of photos processed at the same time, 0 for no limit '
+                             '(default: process.memory_budget in _config.yml)')
+    parser.add_argument('--album-files', choices=['write', 'async', 'skip'],
+                        help='how to write the album JSON files and Horcrux.json '
+                             '(default: process.album_files in _config.yml)')
+    parser.add_argument('--output', choices=['single', 'paged'],
+                        help='one config.json, or pages of photos with config.json as their index '
+                             '(default: process.output in _config.yml)')
+    parser.add_argument('--effort', choices=['fast', 'default', 'max'],
+                        help='encoder effort, fast for previews and max for releases '
+                             '(default: process.encode.effort in _config.yml)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and update the gallery when photos change')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='seconds between two checks for changes in watch mode (default: 2)')
+    parser.add_argument('--profile', action='store_true',
+                        help='time each processing stage, print a report and write it to '
+                             '_data/.horcrux-metrics.json')
+    parser.add_argument('--profile-top', type=int, default=10, metavar='N',
+                        help='number of slowest photos, albums and cameras in the report (default: 10)')
+    parser.add_argument('--plan', action='store_true',
+                        help='only list the photos and album files the build would process, with '
+                             'an estimated time, without decoding, moving or writing anything')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', default=None,
+                        help='ignore the build cache and process every photo again')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    CONFIG.override(WORKERS=args.workers, PIPELINE=args.pipeline, MEMORY_BUDGET=args.memory_budget,
+                    CACHE=args.cache, ALBUM_FILES=args.album_files, OUTPUT=args.output, ENCODE_EFFORT=args.effort)
+    METRICS.enabled = args.profile
+
+    if args.plan:
+        from plan import Plan
+        cache = BuildCache().load() if CONFIG.CACHE else None
+        print(Plan(cache).walk().report())
+        return
+
     log.info('Start processing the gallery...')
-    horcrux = Album(CONFIG.PHOTOS_PATH, 'Horcrux', 0)
-    config = horcrux.format()
-    log.info('Now writing the config file to ' + str(CONFIG.HORCRUX_PATH))
-    write_json(CONFIG.HORCRUX_PATH, config)
-    Nest().main()
-    log.ok('Success! Enjoy~')
+    # Finish the photos a killed build left halfway
+    if journal.recover():
+        log.info('Recovered the interrupted build')
+    cache = BuildCache() if CONFIG.CACHE else None
+    if cache is not None:
+        cache.load()
+    executor = nullcontext()
+    if CONFIG.PIPELINE:
+        from pipeline import PhotoPipeline
+        executor = PhotoPipeline(CONFIG.WORKERS, memory_budget=CONFIG.MEMORY_BUDGET)
+    elif CONFIG.WORKERS != 1:
+        from pool import PhotoPool
+        executor = PhotoPool(CONFIG.WORKERS, CONFIG.MEMORY_BUDGET)
+    # A serial build gets None from the nullcontext, no pool
+    with executor as pool:
+        gallery = Gallery(pool, cache)
+        METRICS.start()
+        gallery.build()
+        log.info('Now writing the config file to ' + str(CONFIG.HORCRUX_PATH))
+        gallery.write()
+        METRICS.stop()
+        log.ok('Success! Enjoy~')
+        if METRICS.enabled:
+            print(METRICS.report(args.profile_top))
+            METRICS.write(CONFIG.METRICS_PATH, args.profile_top)
+        if args.watch:
+            Watcher(gallery, args.interval).run()
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,152 @@
+import os
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+STAGES = ('read', 'exif', 'phash', 'decode', 'watermark', 'resize', 'encode', 'placeholder', 'write', 'delete', 'json')
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Metrics:
+    """
+    Stage timers for the hot paths, enabled with --profile.
+
+    Timings are kept per photo so they can be sent back from the worker
+    processes and attributed to albums and cameras.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.photos = {}
+        self.counters = {}
+        self.started = None
+        self.wall_time = 0.0
+
+    @contextmanager
+    def stage(self, name, photo=None):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, photo)
+
+    def add(self, name, seconds, photo=None):
+        with self.lock:
+            self.stages.setdefault(name, []).append(seconds)
+            if photo is not None:
+                record = self.photos.setdefault(str(photo), {'stages': {}})
+                record['stages'][name] = record['stages'].get(name, 0.0) + seconds
+
+    def tag(self, photo, **info):
+        if self.enabled:
+            with self.lock:
+                self.photos.setdefault(str(photo), {'stages': {}}).update(info)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def records(self):
+        """The records of this process, to be merged into the parent's."""
+        return {'stages': self.stages, 'photos': self.photos, 'counters': self.counters}
+
+    def merge(self, records):
+        if not records:
+            return
+        with self.lock:
+            for name, times in records['stages'].items():
+                self.stages.setdefault(name, []).extend(times)
+            self.photos.update(records['photos'])
+            for name, n in records['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        if self.started is not None:
+            self.wall_time = time.perf_counter() - self.started
+
+    def summary(self, top=10):
+        stages = {}
+        for name in sorted(self.stages, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            times = sorted(self.stages[name])
+            stages[name] = {
+                'count': len(times),
+                'total': round(sum(times), 6),
+                'p50': round(percentile(times, 50), 6),
+                'p90': round(percentile(times, 90), 6),
+                'p99': round(percentile(times, 99), 6),
+                'max': round(times[-1], 6),
+            }
+
+        photos = []
+        groups = {'album': {}, 'camera': {}}
+        for path, record in self.photos.items():
+            total = sum(record['stages'].values())
+            photos.append({'path': path, 'total': round(total, 6), **record})
+            for key, group in groups.items():
+                name = record.get(key, 'Unknown')
+                entry = group.setdefault(name, {'photos': 0, 'total': 0.0})
+                entry['photos'] += 1
+                entry['total'] = round(entry['total'] + total, 6)
+        photos.sort(key=lambda photo: photo['total'], reverse=True)
+
+        return {
+            'wall_time': round(self.wall_time, 6),
+            'photos': len(self.photos),
+            'photos_per_second': round(len(self.photos) / self.wall_time, 3) if self.wall_time else None,
+            'counters': self.counters,
+            'stages': stages,
+            'slowest': photos[:top],
+            'albums': dict(sorted(groups['album'].items(), key=lambda g: -g[1]['total'])),
+            'cameras': dict(sorted(groups['camera'].items(), key=lambda g: -g[1]['total'])),
+            'all_photos': photos,
+        }
+
+    def report(self, top=10):
+        summary = self.summary(top)
+        lines = [f"Processed {summary['photos']} photos in {summary['wall_time']:.2f}s"
+                 + (f" ({summary['photos_per_second']} photos/s)" if summary['photos_per_second'] else '')]
+        for name, n in summary['counters'].items():
+            lines.append(f"  {name}: {n}")
+        lines.append(f"{'stage':<12}{'count':>8}{'total':>10}{'p50':>10}{'p90':>10}{'p99':>10}")
+        for name, stage in summary['stages'].items():
+            lines.append(f"{name:<12}{stage['count']:>8}{stage['total']:>10.3f}"
+                         f"{stage['p50']:>10.4f}{stage['p90']:>10.4f}{stage['p99']:>10.4f}")
+        if summary['slowest']:
+            lines.append(f"Slowest {len(summary['slowest'])} photos:")
+            for photo in summary['slowest']:
+                lines.append(f"  {photo['total']:>8.3f}s  {photo['path']}")
+        for key in ('albums', 'cameras'):
+            if summary[key]:
+                lines.append(f"By {key[:-1]}:")
+                for name, group in list(summary[key].items())[:top]:
+                    lines.append(f"  {group['total']:>8.3f}s  {group['photos']:>5} photos  {name}")
+        return '\n'.join(lines)
+
+    def write(self, path, top=10):
+        tmp = path.with_name(f'.{path.name}.tmp')
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(self.summary(top), indent=2))
+        os.replace(tmp, path)
+
+
+METRICS = Metrics()
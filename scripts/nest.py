@@ -1,11 +1,17 @@
+import re
 import sys
 import json
-from conf import CONFIG, write_json
+from conf import CONFIG, write_json, dump_json
+
+# Site page rendering one page of photos with the gallery layout
+PAGE_FRONT_MATTER = '---\nlayout: gallery\nshard: {shard}\n---\n'
 
 
 class Nest:
-    def __init__(self):
+    def __init__(self, leaves=None):
         self.resources = []
+        # Album items already in memory, by relative path, to skip reading them back
+        self.leaves = leaves or {}
 
     def read_json(self, relative_path):
         abs_path = CONFIG.DIR_PATH.joinpath(relative_path)
@@ -34,7 +40,9 @@ class Nest:
         return [items['dict'][key] for key in items['order'] if key in items['dict']]
 
     def nest_photos(self, album, list_path):
-        items = self.read_json(list_path)
+        items = self.leaves.get(list_path)
+        if items is None:
+            items = self.read_json(list_path)
         photos = self.convert_child_items(items)
         self.append_album(album, photos)
 
@@ -53,10 +61,114 @@ class Nest:
             for child in children:
                 self.nest_album(child)
 
-    def main(self):
-        horcrux = self.read_json(CONFIG.HORCRUX_PATH)
+    def layout(self, album):
+        """Add the masonry layout of the album's photos for every column count."""
+        if CONFIG.MASONRY:
+            album['layout'] = {str(n): masonry(album['list'], n) for n in CONFIG.LAYOUT_COLUMNS}
+        return album
+
+    def paginate(self):
+        """
+        Split the photo lists into pages of CONFIG.PAGE_SIZE photos.
+
+        Every page is written to its own data file, with a site page
+        rendering it. Return the index for config.json: the header of every
+        album, with its number of photos and pages and a cover, the photo
+        lists staying in the pages.
+        """
+        CONFIG.PAGES_DATA_PATH.mkdir(parents=True, exist_ok=True)
+
+        index = []
+        written = set()
+        slugs = set()
+        for album in self.resources:
+            photos = album['list']
+            slug = base = _slugify('-'.join(album.get('parents', [])) or album['name'])
+            n = 1
+            while slug in slugs:
+                n += 1
+                slug = f'{base}-{n}'
+            slugs.add(slug)
+
+            size = CONFIG.PAGE_SIZE
+            pages = max(1, -(-len(photos) // size))
+            header = {
+                'name': album['name'],
+                'parents': album.get('parents', []),
+                'count': len(photos),
+                'pages': pages,
+                'url': f'/{CONFIG.PAGES_SITE_PATH.name}/{slug}/',
+            }
+            for page in range(1, pages + 1):
+                shard = f'{slug}-{page}'
+                data = self.layout({**album, **header, 'page': page, 'list': photos[(page - 1) * size:page * size]})
+                dump_json(CONFIG.PAGES_DATA_PATH / (shard + '.json'), [data])
+                site_page = CONFIG.PAGES_SITE_PATH / slug / str(page) / 'index.html'
+                site_page.parent.mkdir(parents=True, exist_ok=True)
+                site_page.write_text(PAGE_FRONT_MATTER.format(shard=shard))
+                written.update([CONFIG.PAGES_DATA_PATH / (shard + '.json'), site_page])
+            index.append({**header, 'type': 'index', 'cover': _cover(photos[0]) if photos else None})
+        clear_pages(keep=written)
+        return index
+
+    def main(self, horcrux=None):
+        if horcrux is None:
+            horcrux = self.read_json(CONFIG.HORCRUX_PATH)
         self.nest_album(horcrux)
-        write_json(CONFIG.CONFIG_PATH, self.resources)
+        if CONFIG.OUTPUT == 'paged':
+            write_json(CONFIG.CONFIG_PATH, self.paginate())
+        else:
+            write_json(CONFIG.CONFIG_PATH, [self.layout(album) for album in self.resources])
+
+
+def masonry(photos, columns):
+    """
+    Place every photo in the shortest column so far, as a masonry layout
+    would in the browser, with heights in column widths.
+
+    For each photo: its column, the height of the photos above it and their
+    count, for the page to add the frames and gaps. For each column: its
+    height and count.
+    """
+    heights = [0.0] * columns
+    counts = [0] * columns
+    placed = []
+    for photo in photos:
+        column = min(range(columns), key=heights.__getitem__)
+        placed.append([column, round(heights[column], 4), counts[column]])
+        heights[column] += photo['height'] / photo['width']
+        counts[column] += 1
+    return {
+        'photos': placed,
+        'columns': [[round(height, 4), count] for height, count in zip(heights, counts)],
+    }
+
+
+def _cover(photo):
+    """The thumbnail of a photo, shown for its album in the index."""
+    return {key: photo[key] for key in ('width', 'height', 'min_path', 'placeholder', 'color') if key in photo}
+
+
+def clear_pages(keep=()):
+    """
+    Remove the pages of a previous paged build not in keep, the ones just
+    written, leaving any other file.
+    """
+    if CONFIG.PAGES_DATA_PATH.exists():
+        for path in CONFIG.PAGES_DATA_PATH.glob('*.json'):
+            if path not in keep:
+                path.unlink()
+    if CONFIG.PAGES_SITE_PATH.exists():
+        for path in CONFIG.PAGES_SITE_PATH.glob('*/*/index.html'):
+            if path not in keep and path.read_text().startswith(PAGE_FRONT_MATTER.split('{', 1)[0]):
+                path.unlink()
+        for path in sorted(CONFIG.PAGES_SITE_PATH.glob('**/'), reverse=True):
+            if not any(path.iterdir()):
+                path.rmdir()
+
+
+def _slugify(text):
+    return re.sub(r'[^\w]+', '-', text.lower()).strip('-') or 'album'
 
 
 if __name__ == '__main__':
@@ -1,7 +1,25 @@
-from conf import CONFIG
-from PIL import Image, ImageDraw, ImageFont
-from PIL.ExifTags import TAGS, GPSTAGS, IFD
+from conf import CONFIG, temp_path, published_path
+from metrics import METRICS
+from exif import read_header
+from encode import FORMATS, encode, encode_bytes, formats_of, output_path, source_format
+from journal import commit
 from fractions import Fraction
+from functools import lru_cache
+import base64
+import io
+import math
+import shutil
+
+# Reduce by integer factors down to this multiple of the thumbnail size
+# before resampling, in the 'fast' thumbnail quality tier
+FAST_REDUCING_GAP = 1.5
+# Image.thumbnail's default, used by the 'exact' tier
+THUMBNAIL_REDUCING_GAP = 2.0
+
+# Longest side of the inline placeholder, and of the sample its color is taken from
+PLACEHOLDER_SIZE = 16
+COLOR_SAMPLE_SIZE = 64
+
 
 def _format_exposure_fraction(self, value):
     try:
@@ -20,17 +38,34 @@ def _format_exposure_fraction(self, value):
 #register_heif_opener()
 
 class Photo():
-    def __init__(self, path):
+    def __init__(self, path, source=None):
         self.path = path
-        self.min_path = path.with_name(path.stem + '.min.webp')
-
-        # Open the image
-        self.pil_image = Image.open(self.path).convert('RGBA')
-        self.width, self.height = self.pil_image.size
-        self.size = self.pil_image.size
+        # A source kept in CONFIG.SOURCES_PATH is published under
+        # CONFIG.PHOTOS_PATH, other photos are published in place
+        self.target = published_path(path)
+        self.stored = self.target != path
+        # The file content when already read, e.g. by the pipeline's reader
+        self.source = source
+        # Set by the pipeline to hand file writes and deletes to its writer
+        self.writer = None
+        # Outputs of format() waiting to be committed together
+        self._outputs = None
+        suffix = FORMATS[formats_of(CONFIG.THUMBNAIL_ENCODING)[0]][0]
+        self.min_path = self.target.with_name(path.stem + '.min' + suffix)
+        self._pil_image = None
 
-        # Extract EXIF data
-        self.exif_data = self._extract_exif()
+        # Only read the header here, pixels are decoded when first needed
+        with METRICS.stage('exif', self.path):
+            header = read_header(self.source if self.source is not None else self.path)
+            if header is not None:
+                # A JPEG: the size and the used tags, straight from its segments
+                self.size, self.exif_data = header
+            else:
+                with self._open() as image:
+                    self.size = image.size
+                    # Extract EXIF data
+                    self.exif_data = self._extract_exif(image)
+            self.width, self.height = self.size
 
         # Set standard attributes
         self.camera = self.exif_data.get('Make', 'Unknown')
@@ -40,10 +75,15 @@ class Photo():
         self.iso = self.exif_data.get('ISOSpeedRatings', 'Unknown')
         self.focal = self.exif_data.get('FocalLength', 'Unknown')
 
-    def _extract_exif(self):
+    def _open(self):
+        from PIL import Image
+        return Image.open(io.BytesIO(self.source) if self.source is not None else self.path)
+
+    def _extract_exif(self, image):
+        from PIL.ExifTags import TAGS, GPSTAGS, IFD
         exif = {}
         try:
-            raw_exif = self.pil_image.getexif()
+            raw_exif = image.getexif()
 
             # Base IFD
             for k, v in raw_exif.items():
@@ -89,40 +129,65 @@ class Photo():
             return float(value[0]) / value[1]
         return value
 
+    @property
+    def pil_image(self):
+        """The decoded RGBA pixels, loaded on first access."""
+        if self._pil_image is None:
+            with METRICS.stage('decode', self.path), self._open() as image:
+                self._pil_image = image.convert('RGBA')
+        return self._pil_image
+
+    def release(self):
+        """Drop the decoded pixels, they are decoded again if needed."""
+        if self._pil_image is not None:
+            self._pil_image.close()
+            self._pil_image = None
+
     @property
     def is_min(self):
-        return self.path.suffix.lower() == '.webp' and '.min.' in self.path.name
+        return '.min.' in self.path.name
     
     @property
     def has_min(self):
-        return self.min_path.exists()
+        return all(path.exists() for path, _ in self._ladder())
     
     def format(self):
         if self.is_min:
             return None
         
-        if not self.has_min:
-            if CONFIG.SIGN_ORIGINAL:
-                signed_image = self.mark_image(self.pil_image, CONFIG.FONT_SIZE)
-                self.save_image(signed_image, self.path)
+        placeholder = None
+        # Whether the photo is written in the original formats, otherwise
+        # it is published as it is
+        encoded = self.stored
+        # Kept sources are derived again each time they are formatted, the
+        # build cache only lets through those whose file or settings changed.
+        # Other photos with a thumbnail are published already, and signed
+        # then: only their missing thumbnails are made.
+        if self.stored or not self.has_min:
+            published = not self.stored and self.min_path.exists()
+            encoded = self.stored or (CONFIG.SIGN_ORIGINAL and not published)
+            self._outputs = ([], [])
+            try:
+                placeholder = self._write_outputs(published=published)
+            except BaseException:
+                if self.writer is None:
+                    for tmp, _ in self._outputs[0]:
+                        tmp.unlink(missing_ok=True)
+                raise
+            finally:
+                self._outputs = None
+                # Let the full-size pixels go before the next photo is decoded
+                self.release()
+        elif CONFIG.PLACEHOLDER:
+            placeholder = self._placeholder()
 
-            # Resize the image
-            ratio = float(CONFIG.MIN_WIDTH) / self.size[0]
-            new_image_size = tuple([int(x * ratio) for x in self.size])
+        originals = self._sources(self.target, CONFIG.ORIGINAL_ENCODING) if encoded else {}
+        thumbnails = self._sources(self.min_path, CONFIG.THUMBNAIL_ENCODING)
+        METRICS.tag(self.path, album=str(self.target.parent.relative_to(CONFIG.DIR_PATH)),
+                    camera=f"{self.camera} {self.model}".strip(),
+                    megapixels=round(self.size[0] * self.size[1] / 1e6, 3))
 
-            if CONFIG.SIGN_THUMBNAIL:
-                if not CONFIG.SIGN_ORIGINAL:
-                    signed_image = self.mark_image(self.pil_image, CONFIG.FONT_SIZE)
-                signed_image.thumbnail(new_image_size, Image.Resampling.LANCZOS)
-                self.save_image(signed_image, self.min_path)
-            else:
-                min_image = self.pil_image.copy()
-                min_image.thumbnail(new_image_size, Image.Resampling.LANCZOS)
-                self.save_image(min_image, self.min_path)
-
-        relative_path = str(self.path.with_suffix('.webp').relative_to(CONFIG.DIR_PATH))
-        
-        return {
+        photo_conf = {
             "type": 'photo',
             'width': self.size[0],
             'height': self.size[1],
@@ -131,39 +196,300 @@ class Photo():
             'exposure': self._format_exposure_fraction(self.exposure),
             'iso': self._format_exif_value(self.iso, as_type=int),
             'focal': self._format_exif_value(self.focal, digits=1),
-            'path': './' + relative_path,
-            'min_path': './' + str(self.min_path.relative_to(CONFIG.DIR_PATH))
+            'path': next(iter(originals.values()), './' + str(self.path.relative_to(CONFIG.DIR_PATH))),
+            'min_path': next(iter(thumbnails.values())),
+        }
+        # Alternative formats, for <picture> sources
+        if len(originals) > 1:
+            photo_conf['sources'] = originals
+        if len(thumbnails) > 1:
+            photo_conf['min_sources'] = thumbnails
+        if placeholder is not None:
+            photo_conf['placeholder'], photo_conf['color'] = placeholder
+        if CONFIG.THUMBNAIL_WIDTHS:
+            photo_conf['srcset'] = [self._srcset_entry(path, size) for path, size in reversed(self._ladder())]
+        return photo_conf
+
+    def _write_outputs(self, published=False):
+        """
+        Write the thumbnails and the watermarked photo, or only the
+        thumbnails of a published photo, then commit them all at once.
+        Return the placeholder, if enabled.
+        """
+        placeholder = None
+        signed_image = None
+        if CONFIG.SIGN_THUMBNAIL and not published:
+            signed_image = self.mark_image(self.pil_image, CONFIG.FONT_SIZE)
+
+        # Every width is resized from the previous, larger one
+        min_image = signed_image
+        for min_path, size in self._ladder():
+            min_image = self.make_thumbnail(size, min_image)
+            self.save_image(min_image, min_path, CONFIG.THUMBNAIL_ENCODING)
+        if CONFIG.PLACEHOLDER:
+            placeholder = self._placeholder(min_image)
+
+        if self.stored:
+            self._publish(signed_image)
+        elif CONFIG.SIGN_ORIGINAL and not published:
+            if signed_image is None:
+                signed_image = self.mark_image(self.pil_image, CONFIG.FONT_SIZE)
+            self.save_image(signed_image, self.path, CONFIG.ORIGINAL_ENCODING)
+
+        # Move every output in place, then delete the source
+        self._output(commit, self.path, *self._outputs)
+        return placeholder
+
+    def _publish(self, signed_image=None):
+        """
+        Write the published photo of a kept source in every original format:
+        watermarked with SIGN_ORIGINAL, otherwise copied byte for byte in
+        the source's own format and encoded once in the others.
+        """
+        encoding = CONFIG.ORIGINAL_ENCODING
+        formats = formats_of(encoding)
+        own_format = source_format(self.path)
+        if not CONFIG.SIGN_ORIGINAL and own_format in formats:
+            target = output_path(self.target, own_format)
+            tmp = temp_path(target)
+            self._output(self._copy_file, tmp)
+            self._outputs[0].append((tmp, target))
+            formats = tuple(name for name in formats if name != own_format)
+        if not formats:
+            return
+
+        if CONFIG.SIGN_ORIGINAL:
+            image = signed_image
+            if image is None:
+                image = self.mark_image(self.pil_image, CONFIG.FONT_SIZE)
+        else:
+            if signed_image is not None:
+                # The thumbnails' watermark went on the decoded pixels
+                self.release()
+            image = self.pil_image
+        self.save_image(image, self.target, {**encoding, 'formats': list(formats)})
+
+    def _ladder(self):
+        """
+        The path and size of every thumbnail, largest first: min_path at
+        MIN_WIDTH and the THUMBNAIL_WIDTHS narrower than the photo.
+        """
+        widths = {width for width in CONFIG.THUMBNAIL_WIDTHS if width < self.size[0]}
+        widths.discard(CONFIG.MIN_WIDTH)
+        ladder = [(self.min_path, CONFIG.MIN_WIDTH)]
+        ladder += [(self.min_path.with_name(f"{self.path.stem}.{width}w.min{self.min_path.suffix}"), width)
+                   for width in widths]
+        sizes = []
+        for path, width in ladder:
+            ratio = float(width) / self.size[0]
+            sizes.append((path, tuple(int(x * ratio) for x in self.size)))
+        return sorted(sizes, key=lambda step: step[1][0], reverse=True)
+
+    def _placeholder(self, min_image=None):
+        """
+        An inline micro-image and the dominant color, from the smallest
+        thumbnail, read back from disk when it wasn't made in this run.
+        """
+        from PIL import Image
+        with METRICS.stage('placeholder', self.path):
+            if min_image is not None:
+                return _placeholder(min_image)
+            try:
+                with Image.open(self._ladder()[-1][0]) as image:
+                    return _placeholder(image)
+            except OSError as e:
+                print(f"Failed to make a placeholder for {self.path}: {e}")
+                return None
+
+    def _srcset_entry(self, path, size):
+        width, height = _fit_size(self.size, size) or self.size
+        entry = {'width': width, 'height': height,
+                 'path': './' + str(path.relative_to(CONFIG.DIR_PATH))}
+        sources = self._sources(path, CONFIG.THUMBNAIL_ENCODING)
+        if len(sources) > 1:
+            entry['sources'] = sources
+        return entry
+
+    def _sources(self, path, encoding):
+        return {
+            name: './' + str(output_path(path, name).relative_to(CONFIG.DIR_PATH))
+            for name in formats_of(encoding)
         }
     
-    def save_image(self, img, path):
-        output_path = path.with_suffix('.webp')
+    def make_thumbnail(self, size, img=None):
+        """
+        Downscale img, or the photo itself, to fit in size.
+
+        The 'fast' tier lets the JPEG decoder scale down while decoding and
+        reduces in coarser steps before the final Lanczos pass.
+        """
+        from PIL import Image
+        if img is None and CONFIG.THUMBNAIL_QUALITY == 'fast' and self._pil_image is None:
+            with METRICS.stage('decode', self.path), self._open() as image:
+                image.draft(None, size)
+                img = image.convert('RGBA')
+        elif img is None:
+            img = self.pil_image
+
+        reducing_gap = FAST_REDUCING_GAP if CONFIG.THUMBNAIL_QUALITY == 'fast' else THUMBNAIL_REDUCING_GAP
+        with METRICS.stage('resize', self.path):
+            # Same pixels as thumbnail() on a copy, without the full-size copy
+            fitted = _fit_size(img.size, size)
+            if fitted is None:
+                return img.copy()
+            return img.resize(fitted, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
 
+    def save_image(self, img, path, encoding=None):
+        """
+        Encode img next to path in every output format of encoding, the
+        originals' by default, then remove path unless it was overwritten.
+
+        The files are written under temporary names and committed through
+        the journal, at the end of format() when called from it. With the
+        pipeline, they are kept in memory until its writer gets to them.
+        """
         if CONFIG.DEBUG:
             img.show()
+            return []
+
+        encoding = encoding or CONFIG.ORIGINAL_ENCODING
+        renames, deletes = self._outputs if self._outputs is not None else ([], [])
+        if self.writer is None:
+            with METRICS.stage('encode', self.path):
+                staged = encode(img, path, encoding, staged=True)
+            renames.extend(staged)
+            written = [target for _, target in staged]
         else:
-            img.convert('RGB').save(output_path, 'WEBP', quality=95)
+            with METRICS.stage('encode', self.path):
+                outputs = encode_bytes(img, path, encoding)
+            written = [target for target, _ in outputs]
+            for target, data in outputs:
+                tmp = temp_path(target)
+                self.writer(self._write_file, tmp, data)
+                renames.append((tmp, target))
+        # Optionally remove the original, kept sources are never removed
+        if path not in written and not self.stored:
+            deletes.append(path)
+        if self._outputs is None:
+            self._output(commit, self.path, renames, deletes)
+        return written
 
-            # Optionally remove the original
-            if path.suffix.lower() != '.webp':
-                try:
-                    path.unlink()  # Deletes the original file
-                    print(f"Deleted original: {path}")
-                except Exception as e:
-                    print(f"Failed to delete original: {path} — {e}")
+    def _output(self, func, *args):
+        """Run a file operation now, or hand it to the pipeline's writer."""
+        if self.writer is None:
+            func(*args)
+        else:
+            self.writer(func, *args)
+
+    def _write_file(self, path, data):
+        with METRICS.stage('write', self.path):
+            path.write_bytes(data)
+
+    def _copy_file(self, path):
+        with METRICS.stage('write', self.path):
+            if self.source is not None:
+                path.write_bytes(self.source)
+            else:
+                shutil.copyfile(self.path, path)
 
     def mark_image(self, img, fontsize):
-        width, height = img.size
-        transparent_image = Image.new('RGBA', img.size, (255, 255, 255, 0))
-        font = ImageFont.truetype('./assets/font/' + CONFIG.FONT_FAMILY, CONFIG.FONT_SIZE)
-        draw = ImageDraw.Draw(transparent_image)
-
-        t_size = font.getbbox(CONFIG.COPYRIGHT)
-        t_w = t_size[2]
-        t_h = t_size[3]
-
-        x = (width - t_w) / 2
-        y = height - 2 * t_h
-        draw.text((x, y), CONFIG.COPYRIGHT, font=font, fill=(255, 255, 255, 125))
-        transparent_image = transparent_image.rotate(CONFIG.WATERMARK_ROTATE)
-        signed_image = Image.alpha_composite(img, transparent_image)
-        return signed_image
\ No newline at end of file
+        """
+        Watermark img in place and return it.
+
+        Only the region under the text is composited. Rotation turns the
+        text around the image center, like rotating a full-size layer would.
+        """
+        with METRICS.stage('watermark', self.path):
+            width, height = img.size
+            font = _load_font(CONFIG.FONT_FAMILY, fontsize)
+            t_size = font.getbbox(CONFIG.COPYRIGHT)
+            t_w = t_size[2]
+            t_h = t_size[3]
+
+            x = (width - t_w) / 2
+            y = height - 2 * t_h
+            tile = _watermark_tile(CONFIG.COPYRIGHT, CONFIG.FONT_FAMILY, fontsize,
+                                   CONFIG.WATERMARK_ROTATE, x % 1)
+            left, top = int(x), int(y)
+
+            if CONFIG.WATERMARK_ROTATE:
+                angle = math.radians(CONFIG.WATERMARK_ROTATE)
+                dx = x + t_w / 2 - width / 2
+                dy = y + t_h / 2 - height / 2
+                center_x = width / 2 + dx * math.cos(angle) + dy * math.sin(angle)
+                center_y = height / 2 - dx * math.sin(angle) + dy * math.cos(angle)
+                left = round(center_x - tile.width / 2)
+                top = round(center_y - tile.height / 2)
+
+            # Clip the tile to the image
+            src_left, src_top = max(0, -left), max(0, -top)
+            right = min(width, left + tile.width)
+            bottom = min(height, top + tile.height)
+            if right > left + src_left and bottom > top + src_top:
+                img.alpha_composite(
+                    tile,
+                    dest=(left + src_left, top + src_top),
+                    source=(src_left, src_top, right - left, bottom - top),
+                )
+        return img
+
+
+def _fit_size(size, box):
+    """
+    The size Image.thumbnail gives an image of size to fit in box, None
+    when it already fits.
+    """
+    width, height = size
+    x, y = map(math.floor, box)
+    if x >= width and y >= height:
+        return None
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return x, y
+
+
+def _placeholder(img):
+    """
+    A tiny WebP data URI of img and its most common color as '#rrggbb'.
+    """
+    from PIL import Image
+    sample = img.convert('RGB')
+    sample.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE), Image.Resampling.BOX)
+    tiny = sample.resize(_fit_size(sample.size, (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE)) or sample.size,
+                         Image.Resampling.BILINEAR)
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'WEBP', quality=40)
+    data_uri = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    palette = sample.quantize(colors=4)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    return data_uri, f'#{red:02x}{green:02x}{blue:02x}'
+
+
+@lru_cache(maxsize=None)
+def _load_font(family, size):
+    from PIL import ImageFont
+    return ImageFont.truetype(str(CONFIG.FONTS_PATH.joinpath(family)), size)
+
+
+@lru_cache(maxsize=16)
+def _watermark_tile(text, family, size, rotate, offset_x):
+    """
+    The rendered, rotated watermark text, shared by every photo of the run.
+    """
+    from PIL import Image, ImageDraw
+    font = _load_font(family, size)
+    t_size = font.getbbox(text)
+    tile = Image.new('RGBA', (t_size[2] + 1, t_size[3]), (255, 255, 255, 0))
+    ImageDraw.Draw(tile).text((offset_x, 0), text, font=font, fill=(255, 255, 255, 125))
+    if rotate:
+        tile = tile.rotate(rotate, expand=True)
+    return tile
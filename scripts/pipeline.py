@@ -0,0 +1,133 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from metrics import METRICS
+from photo import Photo
+from pool import MemoryBudget, megapixels
+
+# Tells the next stage no more photos are coming
+_DONE = object()
+
+
+class PhotoPipeline:
+    """
+    Format photos in stages linked by bounded queues: a reader thread,
+    `workers` threads decoding, watermarking, resizing and encoding, and a
+    writer thread saving the files and deleting the sources.
+
+    Pillow releases the GIL while decoding, resizing and encoding, so the
+    disk keeps reading and writing while the CPU works. Same submit(path)
+    interface as PhotoPool.
+
+    With a memory budget, in megapixels, the reader waits until the next
+    photo fits in it, and the photo leaves it once its files are written.
+    """
+    def __init__(self, workers=None, queue_size=None, memory_budget=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.budget = MemoryBudget(memory_budget) if memory_budget else None
+        size = queue_size or 2 * self.workers
+        self.read_queue = queue.Queue(size)
+        self.transform_queue = queue.Queue(size)
+        # Each photo queues several writes
+        self.write_queue = queue.Queue(4 * size)
+
+        self.threads = [threading.Thread(target=self._read, name='read')]
+        self.threads += [threading.Thread(target=self._transform, name=f'transform-{i}')
+                         for i in range(self.workers)]
+        self.threads.append(threading.Thread(target=self._write, name='write'))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, path):
+        """
+        Return a future of the photo entry, set once its files are written.
+        Blocks while the queues are full.
+        """
+        future = Future()
+        self.read_queue.put((path, future))
+        return future
+
+    def _read(self):
+        while True:
+            task = self.read_queue.get()
+            if task is _DONE:
+                for _ in range(self.workers):
+                    self.transform_queue.put(_DONE)
+                return
+            path, future = task
+            size = 0
+            if self.budget is not None:
+                size = megapixels(path)
+                self.budget.acquire(size)
+            try:
+                with METRICS.stage('read', path):
+                    source = path.read_bytes()
+            except OSError as e:
+                self._release(size)
+                future.set_exception(e)
+                continue
+            self.transform_queue.put((path, source, future, size))
+
+    def _transform(self):
+        while True:
+            task = self.transform_queue.get()
+            if task is _DONE:
+                self.write_queue.put(_DONE)
+                return
+            path, source, future, size = task
+            errors = []
+
+            def writer(func, *args):
+                self.write_queue.put((func, args, errors))
+
+            try:
+                photo = Photo(path, source)
+                photo.writer = writer
+                photo_conf = photo.format()
+            except Exception as e:
+                self._release(size)
+                future.set_exception(e)
+                continue
+            # Leaves the budget and is resolved once the writer wrote its files
+            self.write_queue.put((self._release, (size,), errors))
+            self.write_queue.put((_resolve, (future, photo_conf), errors))
+
+    def _write(self):
+        running = self.workers
+        while running:
+            task = self.write_queue.get()
+            if task is _DONE:
+                running -= 1
+                continue
+            func, args, errors = task
+            if func is _resolve:
+                _resolve(*args, errors)
+                continue
+            try:
+                func(*args)
+            except Exception as e:
+                errors.append(e)
+
+    def _release(self, size):
+        if self.budget is not None:
+            self.budget.release(size)
+
+    def shutdown(self):
+        self.read_queue.put(_DONE)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def _resolve(future, photo_conf, errors):
+    if errors:
+        future.set_exception(errors[0])
+    else:
+        future.set_result(photo_conf)
@@ -0,0 +1,136 @@
+import json
+from pathlib import Path
+from conf import CONFIG, relative_path
+from encode import formats_of, source_format
+from gallery import Gallery
+from photo import Photo
+
+
+class Plan:
+    """
+    What a build would do, read from the file metadata and the build cache
+    only: no photo is decoded, moved or written.
+    """
+    def __init__(self, cache=None):
+        self.cache = cache
+        # (path, tasks, megapixels) of every photo to process
+        self.photos = []
+        self.album_files = []
+        self.cached = 0
+        self.listed = 0
+        self.unchanged_albums = 0
+        self.errors = []
+
+    @property
+    def megapixels(self):
+        return sum(megapixels for _, _, megapixels in self.photos)
+
+    def walk(self):
+        gallery = Gallery(cache=self.cache)
+        album = gallery._album(CONFIG.PHOTOS_PATH, gallery._previous())
+        album.scan(ingest=False)
+        self._album(album)
+        return self
+
+    def _album(self, album):
+        if album._unchanged():
+            self.unchanged_albums += 1
+            return
+        for entry in album.entries[0]:
+            path = Path(entry.path)
+            if self.cache is not None and self.cache.get(path, entry.stat()) is not None:
+                self.cached += 1
+            else:
+                self._photo(path)
+
+        previous_items = (album.previous or {}).get('items', {}).get('dict', {})
+        for child in album.children:
+            child.previous = previous_items.get(child.name)
+            self._album(child)
+        if not album.children and CONFIG.ALBUM_FILES != 'skip':
+            filename = '-'.join(album._get_album_metadata()) + '.json'
+            self.album_files.append(CONFIG.ALBUMS_PATH / filename)
+
+    def _photo(self, path):
+        try:
+            photo = Photo(path)
+        except Exception as e:
+            self.errors.append((path, e))
+            return
+        # Photos published before sources were kept are listed as they are
+        if not photo.stored and photo.has_min and path.is_relative_to(CONFIG.PHOTOS_PATH):
+            self.listed += 1
+            return
+
+        tasks = []
+        if CONFIG.SIGN_ORIGINAL or CONFIG.SIGN_THUMBNAIL:
+            tasks.append('watermark')
+        tasks.append(f"{len(photo._ladder())} thumbnail(s)")
+        formats = formats_of(CONFIG.ORIGINAL_ENCODING)
+        if CONFIG.SIGN_ORIGINAL or source_format(path) not in formats:
+            tasks.append('encode ' + ', '.join(formats))
+        else:
+            tasks.append('copy' + ''.join(f", encode {name}" for name in formats if name != source_format(path)))
+        self.photos.append((path, tasks, photo.width * photo.height / 1e6))
+
+    def estimate(self, metrics_path=None):
+        """
+        Seconds the photos should take, from the timings of the last build
+        run with --profile, and the seconds per megapixel used. None when
+        there is no such build.
+        """
+        rate = calibration(metrics_path or CONFIG.METRICS_PATH)
+        if rate is None:
+            return None
+        return self.megapixels * rate, rate
+
+    def report(self, metrics_path=None):
+        lines = [f"{len(self.photos)} photos to process ({self.megapixels:.1f} MP), "
+                 f"{self.cached} unchanged, {self.listed} listed as they are, "
+                 f"{self.unchanged_albums} albums unchanged"]
+        for path, tasks, megapixels in self.photos:
+            lines.append(f"  {relative_path(path)}  {megapixels:.1f} MP  {', '.join(tasks)}")
+        for path, error in self.errors:
+            lines.append(f"  {relative_path(path)}  cannot be read: {error}")
+        if self.album_files:
+            lines.append(f"{len(self.album_files)} album files to write:")
+            lines += [f"  {relative_path(path)}" for path in self.album_files]
+        estimate = self.estimate(metrics_path)
+        if estimate is None:
+            lines.append('No profiled build to estimate the time from, run once with --profile')
+        else:
+            seconds, rate = estimate
+            lines.append(f"Estimated time: {_duration(seconds)} "
+                         f"({rate:.2f}s per megapixel in the last profiled build)")
+        return '\n'.join(lines)
+
+
+def calibration(path):
+    """
+    Wall-clock seconds per megapixel of the build profiled in the metrics
+    file at path: the photo work of that build, sped up as much as its
+    workers did.
+    """
+    try:
+        with open(path, 'r') as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    photos = [photo for photo in summary.get('all_photos', []) if photo.get('megapixels')]
+    megapixels = sum(photo['megapixels'] for photo in photos)
+    work = sum(photo['total'] for photo in photos)
+    wall_time = summary.get('wall_time') or 0
+    if not megapixels or not work or not wall_time:
+        return None
+    speedup = max(1.0, work / wall_time)
+    return work / speedup / megapixels
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02}m"
+    if minutes:
+        return f"{minutes}m {seconds:02}s"
+    return f"{seconds}s"
@@ -0,0 +1,111 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from PIL import Image
+from conf import CONFIG
+from metrics import METRICS
+from photo import Photo
+
+
+def _init_worker(settings, profile):
+    # Workers may be spawned rather than forked, so carry over any
+    # command line overrides applied to CONFIG in the parent.
+    CONFIG.override(**settings)
+    METRICS.enabled = profile
+
+
+def format_photo(path):
+    """
+    Format a photo in a worker, returning its entry and the stage timings.
+    """
+    METRICS.reset()
+    photo_conf = Photo(path).format()
+    return photo_conf, METRICS.records() if METRICS.enabled else None
+
+
+def megapixels(path):
+    """The decoded size of a photo, read from its header."""
+    try:
+        with Image.open(path) as image:
+            return image.width * image.height / 1e6
+    except OSError:
+        # Left to the worker to report
+        return 0
+
+
+class MemoryBudget:
+    """
+    Bound the megapixels of the photos being processed at the same time.
+
+    A photo larger than the whole budget is let through once nothing else
+    is in flight, so it is processed alone rather than never.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        with self.condition:
+            if not self._fits(size):
+                METRICS.count('budget_waits')
+                self.condition.wait_for(lambda: self._fits(size))
+            self.in_flight += size
+
+    def release(self, size):
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+    def _fits(self, size):
+        return self.in_flight == 0 or self.in_flight + size <= self.limit
+
+
+class PhotoPool:
+    """
+    Decode, watermark and encode photos in a pool of worker processes.
+
+    With a memory budget, in megapixels, submit() blocks until the photo
+    fits in it, whatever the number of workers.
+    """
+    def __init__(self, workers=None, memory_budget=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.budget = MemoryBudget(memory_budget) if memory_budget else None
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(CONFIG.settings(), METRICS.enabled),
+        )
+
+    def submit(self, path):
+        """
+        Return a future of the photo entry, merging the worker's timings.
+        """
+        result = Future()
+        size = 0
+        if self.budget is not None:
+            size = megapixels(path)
+            self.budget.acquire(size)
+
+        def done(future):
+            if self.budget is not None:
+                self.budget.release(size)
+            try:
+                photo_conf, records = future.result()
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            METRICS.merge(records)
+            result.set_result(photo_conf)
+
+        self.executor.submit(format_photo, path).add_done_callback(done)
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,50 @@
+import pytest
+from PIL import Image
+from conf import CONFIG
+
+
+@pytest.fixture(autouse=True)
+def journal_path(tmp_path, monkeypatch):
+    # Keep the journal of the photos formatted by tests out of the repo
+    monkeypatch.setattr(CONFIG, 'JOURNAL_PATH', tmp_path / '.horcrux-journal')
+    return CONFIG.JOURNAL_PATH
+
+
+@pytest.fixture(autouse=True)
+def sources_path(tmp_path, monkeypatch):
+    # Sources of the albums built by tests are kept next to them
+    monkeypatch.setattr(CONFIG, 'SOURCES_PATH', tmp_path / '_sources')
+    return CONFIG.SOURCES_PATH
+
+
+@pytest.fixture(autouse=True)
+def pages_path(tmp_path, monkeypatch):
+    # Pages of the paged builds run by tests, never the site's own
+    monkeypatch.setattr(CONFIG, 'PAGES_DATA_PATH', tmp_path / '_data' / 'pages')
+    monkeypatch.setattr(CONFIG, 'PAGES_SITE_PATH', tmp_path / 'gallery')
+    return CONFIG.PAGES_DATA_PATH
+
+
+@pytest.fixture
+def gallery_root(tmp_path, monkeypatch):
+    for name, value in {
+        'DIR_PATH': tmp_path,
+        'PHOTOS_PATH': tmp_path / 'photos',
+        'ALBUMS_PATH': tmp_path / 'albums',
+        'HORCRUX_PATH': tmp_path / 'Horcrux.json',
+        'CONFIG_PATH': tmp_path / 'config.json',
+        'SIGN_ORIGINAL': False,
+        'SIGN_THUMBNAIL': False,
+        'KEEP_ORDER': False,
+        'ALBUM_FILES': 'write',
+        'SORT_PHOTOS_BY_TIME': False,
+        'SORT_ALBUMS_BY_TIME': False,
+        'REVERSE_PHOTOS_ORDER': False,
+        'REVERSE_ALBUMS_ORDER': False,
+    }.items():
+        monkeypatch.setattr(CONFIG, name, value)
+    for album in ['a', 'b']:
+        (tmp_path / 'photos' / album).mkdir(parents=True)
+        Image.new('RGB', (800, 600)).save(tmp_path / 'photos' / album / '1.jpg')
+    (tmp_path / 'albums').mkdir()
+    return tmp_path
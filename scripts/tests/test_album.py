@@ -1,3 +1,4 @@
+import os
 import pytest
 from unittest.mock import MagicMock
 from album import Album
@@ -61,3 +62,20 @@ def test_album_without_sub_album(tmp_path, mock_conf):
     config_file = mock_conf.ALBUMS_PATH / f"{album_path.name}.json"
     assert config_file.exists()
     assert config_file.read_text() == "written"
+
+
+def test_scan_sorts_entries_by_cached_stat(tmp_path, monkeypatch):
+    monkeypatch.setattr("album.CONFIG.SORT_PHOTOS_BY_TIME", True)
+    monkeypatch.setattr("album.CONFIG.ORDER_PHOTOS_BY_LAST_DO", 'modify')
+    monkeypatch.setattr("album.CONFIG.REVERSE_PHOTOS_ORDER", True)
+    for i, name in enumerate(["b.jpg", "a.JPG", "c.png", "c.min.webp", "notes.txt"]):
+        (tmp_path / name).write_bytes(b"x")
+        os.utime(tmp_path / name, ns=(i, i))
+    (tmp_path / "sub").mkdir()
+
+    album = Album(tmp_path, tmp_path.name, root=0)
+    image_entries, sub_album_entries = album._scan()
+    photo_entries = album._get_sorted_paths(image_entries, 'photo')
+
+    assert [entry.name for entry in photo_entries] == ["c.png", "a.JPG", "b.jpg"]
+    assert [entry.name for entry in sub_album_entries] == ["sub"]
@@ -0,0 +1,48 @@
+import json
+import benchmark
+from conf import CONFIG, site_paths
+from photo import Photo
+
+
+def test_generate_gallery(tmp_path):
+    count = benchmark.generate_gallery(tmp_path, depth=2, albums=2, photos=3, width=64, height=48)
+
+    assert count == 12
+    photos = sorted(tmp_path.glob('album-0-*/album-1-*/*.jpg'))
+    assert len(photos) == 12
+    photo = Photo(photos[0])
+    assert photo.size == (64, 48)
+    assert photo.camera in {make for make, _ in benchmark.CAMERAS}
+    assert photo.iso != 'Unknown'
+
+
+def test_run_times_every_stage(tmp_path):
+    dir_path = CONFIG.DIR_PATH
+    results = benchmark.run(tmp_path, depth=1, albums=2, photos=2, width=640, height=480)
+
+    assert CONFIG.DIR_PATH == dir_path
+    assert results['gallery']['total_photos'] == 4
+    assert set(results['stages']) == {
+        'walk', 'photo_init', 'exif', 'decode', 'thumbnail', 'watermark',
+        'webp_save', 'webp_save_thumbnail', 'build', 'write_json', 'nest',
+    }
+    assert results['stages']['decode']['count'] == 4
+    json.dumps(results)
+
+
+def test_main_writes_results(tmp_path):
+    output = tmp_path / 'results.json'
+    benchmark.main(['--photos', '1', '--width', '320', '--height', '240', '--output', str(output)])
+
+    assert json.loads(output.read_text())['gallery']['total_photos'] == 2
+
+
+def test_run_keeps_every_file_under_root(tmp_path):
+    root = tmp_path / 'site'
+    paths = {name: getattr(CONFIG, name) for name in site_paths(root)}
+    benchmark.run(root, depth=1, albums=1, photos=1, width=320, height=240)
+
+    assert {name: getattr(CONFIG, name) for name in paths} == paths
+    assert sorted(path.name for path in (root / '_sources').iterdir()) == ['album-0-0']
+    assert not (tmp_path / '_sources').exists()
+    assert not CONFIG.JOURNAL_PATH.exists()
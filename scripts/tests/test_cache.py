@@ -0,0 +1,118 @@
+import os
+import pytest
+from PIL import Image
+import album
+from cache import BuildCache
+from conf import CONFIG
+
+
+@pytest.fixture
+def photo(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'DIR_PATH', tmp_path)
+    path = tmp_path / 'photos' / 'a.jpg'
+    path.parent.mkdir()
+    path.write_bytes(b'jpeg data')
+    path.with_name('a.min.webp').write_bytes(b'thumbnail')
+    return path
+
+
+ENTRY = {'type': 'photo', 'width': 4, 'min_path': './photos/a.min.webp'}
+
+
+def cached(tmp_path, photo):
+    cache = BuildCache(tmp_path / 'cache')
+    assert cache.get(photo) is None
+    cache.put(photo, ENTRY)
+    cache.save()
+    return BuildCache(tmp_path / 'cache').load()
+
+
+def test_unchanged_photo_hits(tmp_path, photo):
+    assert cached(tmp_path, photo).get(photo) == ENTRY
+
+
+def test_touched_photo_with_same_content_hits(tmp_path, photo):
+    cache = cached(tmp_path, photo)
+    os.utime(photo, ns=(1, 1))
+    assert cache.get(photo) == ENTRY
+
+
+def test_modified_photo_misses(tmp_path, photo):
+    cache = cached(tmp_path, photo)
+    photo.write_bytes(b'jpeg data 2')
+    assert cache.get(photo) is None
+
+
+def test_missing_thumbnail_misses(tmp_path, photo):
+    cache = cached(tmp_path, photo)
+    photo.with_name('a.min.webp').unlink()
+    assert cache.get(photo) is None
+
+
+def test_settings_change_drops_records(tmp_path, photo, monkeypatch):
+    cached(tmp_path, photo)
+    monkeypatch.setattr(CONFIG, 'MIN_WIDTH', CONFIG.MIN_WIDTH + 1)
+    assert BuildCache(tmp_path / 'cache').load().get(photo) is None
+
+
+def test_unseen_photos_are_pruned(tmp_path, photo):
+    cache = cached(tmp_path, photo)
+    cache.save()
+    assert BuildCache(tmp_path / 'cache').load().records == {}
+
+
+def test_album_skips_unchanged_photos(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'DIR_PATH', tmp_path)
+    monkeypatch.setattr(CONFIG, 'ALBUMS_PATH', tmp_path)
+    monkeypatch.setattr(CONFIG, 'SIGN_ORIGINAL', False)
+    monkeypatch.setattr(CONFIG, 'SIGN_THUMBNAIL', False)
+    album_dir = tmp_path / 'photos'
+    album_dir.mkdir()
+    Image.new('RGB', (800, 600)).save(album_dir / 'a.jpg')
+
+    cache = BuildCache(tmp_path / 'cache')
+    first = album.Album(album_dir, 'photos', 0, cache=cache).format()
+    cache.save()
+
+    def no_decode(path):
+        raise AssertionError(f'{path} should come from the cache')
+    monkeypatch.setattr(album, 'Photo', no_decode)
+    cache = BuildCache(tmp_path / 'cache').load()
+    assert album.Album(album_dir, 'photos', 0, cache=cache).format() == first
+
+
+def test_records_survive_a_build_killed_before_save(tmp_path, photo):
+    cache = BuildCache(tmp_path / 'cache')
+    cache.get(photo)
+    cache.put(photo, ENTRY)
+    # Torn last line of the log
+    with open(cache.log_path, 'a') as f:
+        f.write('["photos/b.jpg", {"si')
+
+    assert BuildCache(tmp_path / 'cache').load().get(photo) == ENTRY
+
+
+def test_save_removes_the_log(tmp_path, photo):
+    cache = BuildCache(tmp_path / 'cache')
+    cache.get(photo)
+    cache.put(photo, ENTRY)
+    assert cache.log_path.exists()
+    cache.save()
+    assert not cache.log_path.exists()
+
+
+def test_log_of_other_settings_is_dropped(tmp_path, photo, monkeypatch):
+    cache = BuildCache(tmp_path / 'cache')
+    cache.get(photo)
+    cache.put(photo, ENTRY)
+    monkeypatch.setattr(CONFIG, 'MIN_WIDTH', CONFIG.MIN_WIDTH + 1)
+    cache = BuildCache(tmp_path / 'cache').load()
+    assert cache.get(photo) is None
+    assert not cache.log_path.exists()
+
+
+def test_thumbnail_quality_change_drops_records(tmp_path, photo, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'THUMBNAIL_QUALITY', 'fast')
+    cached(tmp_path, photo)
+    monkeypatch.setattr(CONFIG, 'THUMBNAIL_QUALITY', 'exact')
+    assert BuildCache(tmp_path / 'cache').load().get(photo) is None
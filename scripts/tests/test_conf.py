@@ -1,7 +1,7 @@
 import json
 import yaml
 from conf import (
-    merge_list, merge_json, CONFIG
+    merge_list, merge_json, CONFIG, Config
 )
 
 # --- Test Helpers for simulating YAML reload ---
@@ -42,10 +42,46 @@ def test_merge_list_correct():
 
 
 def test_merge_list_partial_match():
+    # 'c' is new and follows 'b' in the new order, the manual a-b order is kept
     keep_order = ['a', 'b']
     new_order = ['b', 'c', 'a']
     merged = merge_list(keep_order, new_order.copy())
-    assert merged == ['b', 'c', 'a']
+    assert merged == ['a', 'b', 'c']
+
+
+def test_merge_list_inserts_new_items_in_the_middle():
+    keep_order = ['c', 'a', 'e', 'b']
+    new_order = ['x', 'a', 'b', 'y', 'c', 'd', 'z']
+    merged = merge_list(keep_order, new_order)
+    assert merged == ['x', 'c', 'd', 'z', 'a', 'b', 'y']
+
+
+def test_merge_list_large_album_is_linear():
+    keep_order = [str(i) for i in reversed(range(50000))]
+    new_order = [str(i) for i in range(50001)]
+    merged = merge_list(keep_order, new_order)
+    assert merged[:2] == ['49999', '50000']
+    assert merged[-1] == '0'
+
+
+def test_merge_json_nested_albums(tmp_path):
+    original = {
+        "items": {
+            "order": ["2019", "2020"],
+            "dict": {"2019": {"items": {"order": ["b", "a"], "dict": {}}}}
+        }
+    }
+    new_data = {
+        "items": {
+            "order": ["2020", "2019"],
+            "dict": {"2019": {"items": {"order": ["a", "b"], "dict": {}}}}
+        }
+    }
+    path = tmp_path / "Horcrux.json"
+    path.write_text(json.dumps(original))
+    result = merge_json(path, new_data)
+    assert result['items']['order'] == ["2019", "2020"]
+    assert result['items']['dict']['2019']['items']['order'] == ["b", "a"]
 
 
 def test_merge_json(tmp_path):
@@ -98,3 +134,32 @@ process:
     assert CONFIG.KEEP_ORDER is True
     assert CONFIG.ORDER_PHOTOS_BY_LAST_DO == 'modify'
     assert CONFIG.REVERSE_PHOTOS_ORDER is False
+
+def test_config_loads_yaml_lazily(tmp_path):
+    yaml_path = tmp_path / "_config.yml"
+    yaml_path.write_text("""
+instagram: lazyuser
+process:
+  workers: 4
+  photo:
+    min_width: 800
+""")
+    config = Config(yaml_path)
+    assert not config._loaded
+
+    config.override(WORKERS=2, CACHE=None)
+    assert config.MIN_WIDTH == 800
+    assert config._loaded
+    # Command line overrides win over _config.yml
+    assert config.WORKERS == 2
+    assert config.CACHE is True
+    assert config.COPYRIGHT == '@lazyuser'
+    assert config.settings()['WORKERS'] == 2
+
+
+def test_site_paths_cover_every_generated_file(tmp_path):
+    from conf import DEFAULT_CONFIG, site_paths
+    paths = site_paths(tmp_path)
+    generated = {name for name in DEFAULT_CONFIG if name.endswith('_PATH')} - {'CONF_YAML_PATH', 'FONTS_PATH'}
+    assert set(paths) == generated
+    assert all(path == tmp_path or tmp_path in path.parents for path in paths.values())
@@ -0,0 +1,95 @@
+import json
+import pytest
+from PIL import Image, ImageDraw
+from cache import BuildCache
+from conf import CONFIG
+from duplicates import dhash
+from gallery import Gallery
+
+
+def shot(path, size=(800, 600), seed=0, quality=95):
+    image = Image.new('RGB', (800, 600), 'white')
+    draw = ImageDraw.Draw(image)
+    for i in range(6):
+        x = (seed * 97 + i * 131) % 800
+        y = (seed * 53 + i * 71) % 600
+        draw.ellipse((x, y, x + 200, y + 150), fill=(40 * i, 200 - 30 * i, 90))
+    image.resize(size).save(path, quality=quality)
+    return path
+
+
+@pytest.fixture
+def copies(gallery_root, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'DUPLICATES', 'share')
+    shot(gallery_root / 'photos' / 'a' / '1.jpg', seed=1)
+    # The same shot, exported smaller to another album
+    shot(gallery_root / 'photos' / 'b' / '1.jpg', size=(400, 300), seed=1, quality=70)
+    shot(gallery_root / 'photos' / 'b' / '2.jpg', seed=2)
+    return gallery_root
+
+
+def build(root):
+    gallery = Gallery(cache=BuildCache(root / 'cache').load())
+    gallery.build()
+    gallery.write()
+    return gallery
+
+
+def test_dhash_is_close_for_copies_only(tmp_path):
+    first = int(dhash(shot(tmp_path / 'a.jpg', seed=1)), 16)
+    copy = int(dhash(shot(tmp_path / 'b.jpg', size=(400, 300), seed=1, quality=70)), 16)
+    other = int(dhash(shot(tmp_path / 'c.jpg', seed=2)), 16)
+    assert (first ^ copy).bit_count() <= 4
+    assert (first ^ other).bit_count() > 4
+
+
+def test_duplicates_share_the_files_of_the_original(copies, capsys):
+    build(copies)
+
+    assert 'Duplicate: _sources/b/1.jpg of _sources/a/1.jpg' in capsys.readouterr().out
+    b = json.loads((copies / 'albums' / 'b.json').read_text())
+    assert b['dict']['1.jpg']['path'] == './photos/a/1.webp'
+    assert b['dict']['2.jpg']['path'] == './photos/b/2.webp'
+    assert not (copies / 'photos' / 'b' / '1.webp').exists()
+    assert not (copies / 'photos' / 'b' / '1.min.webp').exists()
+
+    # Hashes are recorded, the next build reads nothing again
+    cache = BuildCache(copies / 'cache').load()
+    assert cache.phash(copies / '_sources' / 'b' / '1.jpg', (copies / '_sources' / 'b' / '1.jpg').stat())
+    assert build(copies).duplicates.originals == {
+        copies / '_sources' / 'b' / '1.jpg': (copies / '_sources' / 'a' / '1.jpg', 0),
+    }
+
+
+def test_reported_duplicates_keep_their_files(copies, monkeypatch, capsys):
+    monkeypatch.setattr(CONFIG, 'DUPLICATES', 'report')
+
+    build(copies)
+
+    assert 'Duplicate:' in capsys.readouterr().out
+    b = json.loads((copies / 'albums' / 'b.json').read_text())
+    assert b['dict']['1.jpg']['path'] == './photos/b/1.webp'
+
+
+def test_stopping_sharing_gives_duplicates_their_files(copies, monkeypatch):
+    build(copies)
+    monkeypatch.setattr(CONFIG, 'DUPLICATES', False)
+
+    build(copies)
+
+    b = json.loads((copies / 'albums' / 'b.json').read_text())
+    assert b['dict']['1.jpg']['path'] == './photos/b/1.webp'
+    assert (copies / 'photos' / 'b' / '1.webp').exists()
+
+
+def test_replacing_the_original_gives_the_duplicate_its_files(copies):
+    build(copies)
+    # Another shot under the name of the original
+    shot(copies / '_sources' / 'a' / '1.jpg', seed=3)
+
+    gallery = build(copies)
+
+    assert gallery.duplicates.originals == {}
+    b = json.loads((copies / 'albums' / 'b.json').read_text())
+    assert b['dict']['1.jpg']['path'] == './photos/b/1.webp'
+    assert (copies / 'photos' / 'b' / '1.webp').exists()
@@ -0,0 +1,56 @@
+import pytest
+from PIL import Image, features
+from conf import CONFIG
+from encode import encode, output_formats, output_path, save_options
+from photo import Photo
+
+
+@pytest.fixture
+def image():
+    return Image.linear_gradient('L').resize((64, 48)).convert('RGBA')
+
+
+def test_writes_every_format_from_one_image(tmp_path, image, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'ENCODE_EFFORT', 'fast')
+    formats = ['jpeg', 'webp'] + (['avif'] if features.check('avif') else [])
+    written = encode(image, tmp_path / 'a.png', {'formats': formats, 'quality': 80})
+
+    assert [path.suffix for path in written] == [output_path(tmp_path / 'a.png', f).suffix for f in formats]
+    for path in written:
+        with Image.open(path) as saved:
+            assert saved.size == (64, 48)
+
+
+def test_unknown_formats_fall_back_to_webp():
+    assert output_formats(('gif',)) == ('webp',)
+    assert output_formats(('jpeg', 'jpeg')) == ('jpeg',)
+
+
+def test_jpeg_keeps_source_name(tmp_path):
+    assert output_path(tmp_path / 'a.JPG', 'jpeg') == tmp_path / 'a.JPG'
+    assert output_path(tmp_path / 'a.png', 'jpeg') == tmp_path / 'a.jpg'
+
+
+def test_effort_tiers():
+    encoding = {'quality': 90, 'lossless': True}
+    assert save_options('webp', encoding, 'fast') == {'method': 0, 'quality': 90, 'lossless': True}
+    assert save_options('webp', encoding, 'max')['method'] == 6
+    assert save_options('jpeg', encoding, 'max') == {'optimize': True, 'progressive': True, 'quality': 90}
+
+
+def test_photo_lists_alternative_formats(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'DIR_PATH', tmp_path)
+    monkeypatch.setattr(CONFIG, 'SIGN_ORIGINAL', False)
+    monkeypatch.setattr(CONFIG, 'SIGN_THUMBNAIL', False)
+    monkeypatch.setattr(CONFIG, 'MIN_WIDTH', 32)
+    monkeypatch.setattr(CONFIG, 'THUMBNAIL_ENCODING', {'formats': ['jpeg', 'webp'], 'quality': 80})
+    path = tmp_path / 'photos' / 'a.png'
+    path.parent.mkdir()
+    Image.new('RGB', (64, 48), 'red').save(path)
+
+    entry = Photo(path).format()
+
+    assert entry['min_path'] == './photos/a.min.jpg'
+    assert entry['min_sources'] == {'jpeg': './photos/a.min.jpg', 'webp': './photos/a.min.webp'}
+    assert (tmp_path / 'photos' / 'a.min.webp').exists()
+    assert path.exists()
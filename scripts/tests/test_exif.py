@@ -0,0 +1,54 @@
+import pytest
+from PIL import Image
+from exif import read_header, read_directory
+
+
+def save_jpeg(path, size=(64, 48), big_endian=False):
+    exif = Image.Exif()
+    if big_endian:
+        exif.endian = '>'
+    exif[0x010F] = 'FUJIFILM'
+    exif[0x0110] = 'X-E2S'
+    exif[0x8769] = {0x829D: 2.8, 0x829A: 1 / 250, 0x8827: 800, 0x920A: 35.0}
+    Image.new('RGB', size).save(path, exif=exif)
+    return path
+
+
+@pytest.mark.parametrize('big_endian', [False, True])
+def test_reads_size_and_whitelisted_tags(tmp_path, big_endian):
+    path = save_jpeg(tmp_path / 'a.jpg', big_endian=big_endian)
+
+    size, tags = read_header(path)
+
+    assert size == (64, 48)
+    assert tags['Make'] == 'FUJIFILM'
+    assert tags['Model'] == 'X-E2S'
+    assert tags['FNumber'] == pytest.approx(2.8)
+    assert tags['ExposureTime'] == pytest.approx(1 / 250)
+    assert tags['ISOSpeedRatings'] == 800
+    assert tags['FocalLength'] == 35.0
+    assert read_header(path.read_bytes()) == (size, tags)
+
+
+def test_jpeg_without_exif(tmp_path):
+    Image.new('RGB', (10, 20)).save(tmp_path / 'a.jpg')
+    assert read_header(tmp_path / 'a.jpg') == ((10, 20), {})
+
+
+def test_other_files_are_left_to_pillow(tmp_path):
+    Image.new('RGB', (10, 20)).save(tmp_path / 'a.png')
+    (tmp_path / 'b.jpg').write_bytes(b'\xff\xd8\xff\xe1\x00')
+    assert read_header(tmp_path / 'a.png') is None
+    assert read_header(tmp_path / 'b.jpg') is None
+    assert read_header(tmp_path / 'missing.jpg') is None
+
+
+def test_read_directory(tmp_path):
+    save_jpeg(tmp_path / 'a.jpg')
+    save_jpeg(tmp_path / 'b.JPEG', size=(32, 32))
+    Image.new('RGB', (10, 20)).save(tmp_path / 'c.png')
+
+    headers = read_directory(tmp_path)
+
+    assert sorted(headers) == ['a.jpg', 'b.JPEG']
+    assert headers['b.JPEG'][0] == (32, 32)
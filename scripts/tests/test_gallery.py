@@ -0,0 +1,179 @@
+import json
+import pytest
+from PIL import Image
+from cache import BuildCache
+from conf import CONFIG
+from gallery import Gallery
+
+
+def build(tmp_path):
+    cache = BuildCache(tmp_path / 'cache').load()
+    gallery = Gallery(cache=cache)
+    gallery.build()
+    gallery.write()
+    return gallery
+
+
+def test_unchanged_albums_are_reused(gallery_root, capsys):
+    first = build(gallery_root)
+    album_files = {path: path.stat().st_mtime_ns for path in (gallery_root / 'albums').iterdir()}
+    capsys.readouterr()
+
+    second = build(gallery_root)
+
+    assert second.tree == json.loads(json.dumps(first.tree))
+    assert 'Processing album' not in capsys.readouterr().out
+    assert {path: path.stat().st_mtime_ns for path in album_files} == album_files
+
+
+def test_only_changed_albums_are_formatted(gallery_root, capsys):
+    build(gallery_root)
+    untouched = (gallery_root / 'albums' / 'b.json').stat().st_mtime_ns
+    Image.new('RGB', (400, 600)).save(gallery_root / 'photos' / 'a' / '2.jpg')
+    capsys.readouterr()
+
+    gallery = build(gallery_root)
+
+    out = capsys.readouterr().out
+    assert 'Processing album: a' in out
+    assert 'Processing album: b' not in out
+    assert (gallery_root / 'albums' / 'b.json').stat().st_mtime_ns == untouched
+    config = json.loads(CONFIG.CONFIG_PATH.read_text())
+    assert [album['name'] for album in config] == ['a', 'b']
+    assert [photo['width'] for photo in config[0]['list']][-1] == 400
+    assert gallery.cache.album(gallery_root / 'photos' / 'b') is not None
+
+
+def test_missing_album_file_formats_again(gallery_root, capsys):
+    build(gallery_root)
+    (gallery_root / 'albums' / 'b.json').unlink()
+    capsys.readouterr()
+
+    build(gallery_root)
+
+    assert 'Processing album: b' in capsys.readouterr().out
+    assert (gallery_root / 'albums' / 'b.json').exists()
+
+
+@pytest.mark.parametrize('name', ['1.webp', '1.min.webp'])
+def test_deleted_photo_output_is_derived_again(gallery_root, capsys, name):
+    build(gallery_root)
+    (gallery_root / 'photos' / 'a' / name).unlink()
+    capsys.readouterr()
+
+    build(gallery_root)
+
+    out = capsys.readouterr().out
+    assert 'Processing album: a' in out
+    assert 'Processing album: b' not in out
+    assert (gallery_root / 'photos' / 'a' / name).exists()
+
+
+def test_sources_are_kept_and_published(gallery_root):
+    source = (gallery_root / 'photos' / 'a' / '1.jpg').read_bytes()
+
+    gallery = build(gallery_root)
+
+    assert (gallery_root / '_sources' / 'a' / '1.jpg').read_bytes() == source
+    assert not (gallery_root / 'photos' / 'a' / '1.jpg').exists()
+    assert (gallery_root / 'photos' / 'a' / '1.webp').exists()
+    photos = json.loads((gallery_root / 'albums' / 'a.json').read_text())
+    assert photos['order'] == ['1.jpg']
+    assert photos['dict']['1.jpg']['path'] == './photos/a/1.webp'
+    assert build(gallery_root).tree == json.loads(json.dumps(gallery.tree))
+
+
+def test_source_in_output_format_is_copied(gallery_root, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'ORIGINAL_ENCODING', {'formats': ['jpeg', 'webp'], 'quality': 80})
+    source = (gallery_root / 'photos' / 'a' / '1.jpg').read_bytes()
+
+    build(gallery_root)
+
+    assert (gallery_root / 'photos' / 'a' / '1.jpg').read_bytes() == source
+    assert (gallery_root / 'photos' / 'a' / '1.webp').exists()
+
+
+def test_settings_change_derives_again_from_the_source(gallery_root, monkeypatch):
+    build(gallery_root)
+    published = (gallery_root / 'photos' / 'a' / '1.webp').read_bytes()
+    monkeypatch.setattr(CONFIG, 'ORIGINAL_ENCODING', {'formats': ['webp'], 'quality': 50})
+
+    build(gallery_root)
+
+    assert (gallery_root / 'photos' / 'a' / '1.webp').read_bytes() != published
+    assert (gallery_root / '_sources' / 'a' / '1.jpg').exists()
+
+
+def test_photos_published_before_stay_in_place(gallery_root):
+    album = gallery_root / 'photos' / 'b'
+    (album / '1.jpg').unlink()
+    Image.new('RGB', (800, 600)).save(album / '2.webp')
+    Image.new('RGB', (600, 450)).save(album / '2.min.webp')
+    published = (album / '2.webp').read_bytes()
+
+    build(gallery_root)
+
+    assert (album / '2.webp').read_bytes() == published
+    assert not (gallery_root / '_sources' / 'b').exists()
+    assert json.loads((gallery_root / 'albums' / 'b.json').read_text())['order'] == ['2.webp']
+
+
+def test_photos_published_before_keep_their_key_and_exif(gallery_root, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'KEEP_ORDER', True)
+    album = gallery_root / 'photos' / 'b'
+    (album / '1.jpg').unlink()
+    for name in ['2', '3']:
+        Image.new('RGB', (800, 600)).save(album / f'{name}.webp')
+        Image.new('RGB', (600, 450)).save(album / f'{name}.min.webp')
+    # Written when the photos were signed in place, from the JPEGs
+    (gallery_root / 'albums' / 'b.json').write_text(json.dumps({
+        'order': ['3.JPG', '2.JPG'],
+        'dict': {
+            f'{name}.JPG': {'type': 'photo', 'path': f'./photos/b/{name}.webp', 'camera': 'Canon', 'iso': 100}
+            for name in ['2', '3']
+        },
+    }))
+
+    for _ in range(2):
+        build(gallery_root)
+        photos = json.loads((gallery_root / 'albums' / 'b.json').read_text())
+        assert photos['order'] == ['3.JPG', '2.JPG']
+        assert photos['dict']['2.JPG']['camera'] == 'Canon'
+        assert photos['dict']['2.JPG']['iso'] == 100
+        assert photos['dict']['2.JPG']['width'] == 800
+
+
+def test_deleting_a_source_removes_its_photo(gallery_root):
+    build(gallery_root)
+    (gallery_root / '_sources' / 'a' / '1.jpg').unlink()
+    Image.new('RGB', (400, 600)).save(gallery_root / 'photos' / 'a' / '2.jpg')
+
+    build(gallery_root)
+
+    assert sorted(path.name for path in (gallery_root / 'photos' / 'a').iterdir()) == ['2.min.webp', '2.webp']
+    assert json.loads((gallery_root / 'albums' / 'a.json').read_text())['order'] == ['2.jpg']
+
+
+def test_photo_named_like_a_kept_source_is_reported(gallery_root, capsys):
+    build(gallery_root)
+    source = (gallery_root / '_sources' / 'a' / '1.jpg').read_bytes()
+    Image.new('RGB', (400, 600)).save(gallery_root / 'photos' / 'a' / '1.jpg')
+    capsys.readouterr()
+
+    build(gallery_root)
+
+    assert 'Conflict: ' + str(gallery_root / 'photos' / 'a' / '1.jpg') in capsys.readouterr().out
+    assert (gallery_root / '_sources' / 'a' / '1.jpg').read_bytes() == source
+    assert json.loads((gallery_root / 'albums' / 'a.json').read_text())['order'] == ['1.jpg']
+
+
+def test_effort_change_encodes_again(gallery_root, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'ENCODE_EFFORT', 'fast')
+    build(gallery_root)
+    published = gallery_root / 'photos' / 'a' / '1.webp'
+    fast = published.stat().st_mtime_ns
+
+    monkeypatch.setattr(CONFIG, 'ENCODE_EFFORT', 'max')
+    build(gallery_root)
+
+    assert published.stat().st_mtime_ns != fast
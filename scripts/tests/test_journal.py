@@ -0,0 +1,68 @@
+import json
+import journal
+from conf import CONFIG, atomic_write, temp_path
+
+
+def test_commit_moves_outputs_and_deletes_sources(tmp_path):
+    tmp = tmp_path / '.a.webp.tmp'
+    tmp.write_bytes(b'webp')
+    source = tmp_path / 'a.jpg'
+    source.write_bytes(b'jpeg')
+
+    journal.commit(source, [(tmp, tmp_path / 'a.webp')], [source])
+
+    assert (tmp_path / 'a.webp').read_bytes() == b'webp'
+    assert not tmp.exists() and not source.exists()
+    assert journal.recover() == 0
+
+
+def test_recover_finishes_an_interrupted_commit(tmp_path):
+    done = tmp_path / 'a.min.webp'
+    done.write_bytes(b'thumbnail')
+    tmp = tmp_path / '.a.webp.tmp'
+    tmp.write_bytes(b'webp')
+    source = tmp_path / 'a.jpg'
+    source.write_bytes(b'jpeg')
+    record = {
+        'photo': str(source),
+        'renames': [[str(tmp_path / '.a.min.webp.tmp'), str(done)], [str(tmp), str(tmp_path / 'a.webp')]],
+        'deletes': [str(source)],
+    }
+    # Killed after the first rename, and while logging another photo
+    CONFIG.JOURNAL_PATH.write_text(json.dumps(record) + '\n{"photo": "b.j')
+
+    assert journal.recover() == 1
+    assert done.read_bytes() == b'thumbnail'
+    assert (tmp_path / 'a.webp').read_bytes() == b'webp'
+    assert not source.exists()
+    assert not CONFIG.JOURNAL_PATH.exists()
+
+
+def test_atomic_write_keeps_the_old_file_on_failure(tmp_path):
+    path = tmp_path / 'a.json'
+    path.write_text('old')
+    try:
+        with atomic_write(path) as tmp:
+            tmp.write_text('new')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert path.read_text() == 'old'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_recover_deletes_unfinished_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'PHOTOS_PATH', tmp_path / 'photos')
+    monkeypatch.setattr(CONFIG, 'ALBUMS_PATH', tmp_path / 'albums')
+    monkeypatch.setattr(CONFIG, 'HORCRUX_PATH', tmp_path / 'Horcrux.json')
+    (tmp_path / 'photos' / 'a').mkdir(parents=True)
+    photo = tmp_path / 'photos' / 'a' / 'a.jpg'
+    photo.write_bytes(b'jpeg')
+    # Killed while encoding, before the photo was committed
+    journal.begin()
+    unfinished = temp_path(tmp_path / 'photos' / 'a' / 'a.webp')
+    unfinished.write_bytes(b'we')
+
+    assert journal.recover() == 0
+    assert list((tmp_path / 'photos' / 'a').iterdir()) == [photo]
+    assert not CONFIG.JOURNAL_PATH.exists()
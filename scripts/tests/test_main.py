@@ -0,0 +1,35 @@
+import json
+import pytest
+from PIL import Image
+from conf import CONFIG
+import main
+
+
+@pytest.fixture
+def site_root(tmp_path, monkeypatch):
+    for name, value in {
+        'DIR_PATH': tmp_path,
+        'PHOTOS_PATH': tmp_path / 'photos',
+        'ALBUMS_PATH': tmp_path / 'albums',
+        'HORCRUX_PATH': tmp_path / 'Horcrux.json',
+        'CONFIG_PATH': tmp_path / 'config.json',
+        'CACHE': False,
+        'SIGN_ORIGINAL': False,
+        'SIGN_THUMBNAIL': False,
+        'KEEP_ORDER': False,
+        'ALBUM_FILES': 'write',
+    }.items():
+        monkeypatch.setattr(CONFIG, name, value)
+    (tmp_path / 'photos' / 'a').mkdir(parents=True)
+    Image.new('RGB', (800, 600)).save(tmp_path / 'photos' / 'a' / '1.jpg')
+    return tmp_path
+
+
+def test_serial_build(site_root, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'WORKERS', 1)
+    main.main([])
+
+    config = json.loads((site_root / 'config.json').read_text())
+    assert [album['name'] for album in config] == ['a']
+    assert len(config[0]['list']) == 1
+    assert (site_root / config[0]['list'][0]['min_path']).exists()
@@ -0,0 +1,77 @@
+import json
+import pytest
+from PIL import Image
+from conf import CONFIG
+from metrics import Metrics, METRICS, percentile
+from photo import Photo
+from pool import PhotoPool
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    monkeypatch.setattr(CONFIG, 'DIR_PATH', tmp_path)
+    monkeypatch.setattr(CONFIG, 'SIGN_ORIGINAL', False)
+    monkeypatch.setattr(CONFIG, 'SIGN_THUMBNAIL', False)
+    monkeypatch.setattr(METRICS, 'enabled', True)
+    METRICS.reset()
+    yield METRICS
+    METRICS.reset()
+
+
+def make_photo(tmp_path, name):
+    path = tmp_path / 'album' / name
+    path.parent.mkdir(exist_ok=True)
+    Image.new('RGB', (800, 600)).save(path)
+    return path
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 90) == 0.0
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    with metrics.stage('decode', 'a.jpg'):
+        pass
+    metrics.tag('a.jpg', camera='X')
+    assert metrics.stages == {} and metrics.photos == {}
+
+
+def test_photo_stages_are_recorded(tmp_path, profiling):
+    path = make_photo(tmp_path, 'a.jpg')
+    Photo(path).format()
+
+    record = profiling.photos[str(path)]
+    # Encoded straight to the files, the writes are timed with the encoding
+    assert set(record['stages']) == {'exif', 'decode', 'resize', 'encode', 'placeholder'}
+    assert record['album'] == 'album'
+    assert record['megapixels'] == 0.48
+
+
+def test_pool_sends_worker_timings_back(tmp_path, profiling):
+    paths = [make_photo(tmp_path, f'{i}.jpg') for i in range(3)]
+    with PhotoPool(2) as pool:
+        futures = [pool.submit(path) for path in paths]
+        assert all(future.result()['type'] == 'photo' for future in futures)
+
+    assert set(profiling.photos) == {str(path) for path in paths}
+    assert profiling.summary()['stages']['encode']['count'] == 3
+
+
+def test_report_and_write(tmp_path, profiling):
+    profiling.start()
+    for i in range(3):
+        Photo(make_photo(tmp_path, f'{i}.jpg')).format()
+    profiling.stop()
+
+    report = profiling.report(top=2)
+    assert 'Slowest 2 photos' in report
+    assert 'encode' in report
+    profiling.write(tmp_path / 'metrics.json', top=2)
+    summary = json.loads((tmp_path / 'metrics.json').read_text())
+    assert summary['photos'] == 3
+    assert len(summary['slowest']) == 2
+    assert summary['photos_per_second'] > 0
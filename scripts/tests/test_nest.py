@@ -105,3 +105,105 @@ def test_nest_album_handles_nested(monkeypatch):
 
     # Two albums added: one for img1, one from sub.json
     assert nest.append_album.call_count == 2
+
+
+def test_nest_uses_leaves_in_memory(monkeypatch):
+    leaves = {'sub.json': {'dict': {'pic1': {'type': 'photo'}}, 'order': ['pic1']}}
+    nest = Nest(leaves)
+    monkeypatch.setattr(nest, "read_json", MagicMock(side_effect=AssertionError))
+
+    nest.nest_album({
+        'type': 'album',
+        'no_sub_album': True,
+        'name': 'sub',
+        'path': 'sub.json',
+        'parents': ['sub']
+    })
+
+    assert nest.resources == [{
+        'name': 'sub',
+        'type': 'photos',
+        'parents': ['sub'],
+        'list': [{'type': 'photo'}]
+    }]
+
+
+def test_paged_output_writes_pages_and_index(monkeypatch, tmp_path):
+    import json
+    from conf import CONFIG
+    monkeypatch.setattr(CONFIG, "OUTPUT", "paged")
+    monkeypatch.setattr(CONFIG, "PAGE_SIZE", 2)
+    monkeypatch.setattr(CONFIG, "KEEP_ORDER", False)
+    monkeypatch.setattr(CONFIG, "CONFIG_PATH", tmp_path / "config.json")
+    monkeypatch.setattr(CONFIG, "PAGES_DATA_PATH", tmp_path / "_data" / "pages")
+    monkeypatch.setattr(CONFIG, "PAGES_SITE_PATH", tmp_path / "gallery")
+    # A page left from a previous build
+    stale = tmp_path / "gallery" / "old" / "1" / "index.html"
+    stale.parent.mkdir(parents=True)
+    stale.write_text("---\nlayout: gallery\nshard: old-1\n---\n")
+
+    photos = [{'type': 'photo', 'path': f'./{i}.webp', 'min_path': f'./{i}.min.webp'} for i in range(5)]
+    Nest({'a.json': {'dict': {str(i): p for i, p in enumerate(photos)}, 'order': list('01234')}}).main({
+        'type': 'album', 'no_sub_album': True, 'name': 'Trip Day', 'path': 'a.json', 'parents': ['2019', 'Trip Day']
+    })
+
+    index = json.loads((tmp_path / "config.json").read_text())
+    assert index == [{
+        'name': 'Trip Day', 'parents': ['2019', 'Trip Day'], 'count': 5, 'pages': 3,
+        'url': '/gallery/2019-trip-day/', 'type': 'index', 'cover': {'min_path': './0.min.webp'},
+    }]
+    first = json.loads((tmp_path / "_data" / "pages" / "2019-trip-day-1.json").read_text())
+    assert (first[0]['page'], first[0]['list']) == (1, photos[:2])
+    last = json.loads((tmp_path / "_data" / "pages" / "2019-trip-day-3.json").read_text())
+    assert last[0]['list'] == photos[4:]
+    assert "shard: 2019-trip-day-2" in (tmp_path / "gallery" / "2019-trip-day" / "2" / "index.html").read_text()
+    assert not (tmp_path / "gallery" / "old").exists()
+
+
+def test_masonry_places_photos_in_the_shortest_column():
+    from nest import masonry
+    photos = [{'width': 4, 'height': h} for h in (6, 3, 3, 4, 2)]
+
+    layout = masonry(photos, 2)
+
+    assert layout['photos'] == [[0, 0.0, 0], [1, 0.0, 0], [1, 0.75, 1], [0, 1.5, 1], [1, 1.5, 2]]
+    assert layout['columns'] == [[2.5, 2], [2.0, 3]]
+
+
+def test_masonry_layout_for_every_column_count(monkeypatch, tmp_path):
+    import json
+    from conf import CONFIG
+    monkeypatch.setattr(CONFIG, "OUTPUT", "single")
+    monkeypatch.setattr(CONFIG, "MASONRY", True)
+    monkeypatch.setattr(CONFIG, "LAYOUT_COLUMNS", [3, 2])
+    monkeypatch.setattr(CONFIG, "KEEP_ORDER", False)
+    monkeypatch.setattr(CONFIG, "CONFIG_PATH", tmp_path / "config.json")
+    monkeypatch.setattr(CONFIG, "PAGES_DATA_PATH", tmp_path / "_data" / "pages")
+    monkeypatch.setattr(CONFIG, "PAGES_SITE_PATH", tmp_path / "gallery")
+
+    photos = [{'type': 'photo', 'width': 3, 'height': 2} for _ in range(4)]
+    Nest({'a.json': {'dict': {str(i): p for i, p in enumerate(photos)}, 'order': list('0123')}}).main({
+        'type': 'album', 'no_sub_album': True, 'name': 'a', 'path': 'a.json', 'parents': ['a']
+    })
+
+    album = json.loads((tmp_path / "config.json").read_text())[0]
+    assert sorted(album['layout']) == ['2', '3']
+    assert [column for column, _, _ in album['layout']['3']['photos']] == [0, 1, 2, 0]
+    assert album['layout']['2']['columns'] == [[1.3333, 2], [1.3333, 2]]
+
+
+def test_single_output_leaves_pages_alone(monkeypatch, tmp_path):
+    from conf import CONFIG
+    monkeypatch.setattr(CONFIG, "OUTPUT", "single")
+    monkeypatch.setattr(CONFIG, "MASONRY", False)
+    monkeypatch.setattr(CONFIG, "KEEP_ORDER", False)
+    monkeypatch.setattr(CONFIG, "CONFIG_PATH", tmp_path / "config.json")
+    shard = CONFIG.PAGES_DATA_PATH / "a-1.json"
+    shard.parent.mkdir(parents=True)
+    shard.write_text("[]")
+
+    Nest({'a.json': {'dict': {}, 'order': []}}).main({
+        'type': 'album', 'no_sub_album': True, 'name': 'a', 'path': 'a.json', 'parents': ['a']
+    })
+
+    assert shard.read_text() == "[]"
@@ -1,9 +1,11 @@
+import base64
+import io
 from pathlib import Path
 import tempfile
 import shutil
 import pytest
-from PIL import Image
-from photo import Photo  # Assuming Photo class is in photo.py
+from PIL import Image, ImageChops
+from photo import Photo, _watermark_tile  # Assuming Photo class is in photo.py
 
 # Fixture to create a temporary image file for testing
 @pytest.fixture
@@ -101,3 +103,157 @@ def test_fallback_or_error_on_missing_font(temp_image, monkeypatch):
 
     with pytest.raises(IOError, match="Font not found"):
         photo.mark_image(photo.pil_image, MockConf.FONT_SIZE)  # Should raise an IOError because font is missing
+
+
+@pytest.fixture
+def rgb_image(tmp_path):
+    image_path = tmp_path / "rgb_image.jpg"
+    exif = Image.Exif()
+    exif[0x010F] = "FUJIFILM"
+    Image.new("RGB", (800, 600), (0, 128, 255)).save(image_path, exif=exif)
+    return image_path
+
+
+# Test that constructing a Photo only reads the header
+def test_init_reads_header_without_decoding(rgb_image):
+    photo = Photo(rgb_image)
+
+    assert photo.size == (800, 600)
+    assert photo.camera == "FUJIFILM"
+    assert photo._pil_image is None
+
+    assert photo.pil_image.mode == "RGBA"
+    assert photo.pil_image.size == (800, 600)
+
+
+# Test that an already processed photo is formatted without decoding its pixels
+def test_format_with_existing_min_does_not_decode(rgb_image, monkeypatch):
+    monkeypatch.setattr("photo.CONFIG.DIR_PATH", rgb_image.parent)
+    photo = Photo(rgb_image)
+    photo.min_path.touch()
+
+    result = photo.format()
+
+    assert result["width"] == 800
+    assert photo._pil_image is None
+
+
+# Test that the fast thumbnail tier uses a scaled decode instead of the full pixels
+def test_fast_thumbnail_skips_full_decode(tmp_path, monkeypatch):
+    image_path = tmp_path / "large.jpg"
+    Image.new("RGB", (4000, 3000), (0, 128, 255)).save(image_path)
+    monkeypatch.setattr("photo.CONFIG.THUMBNAIL_QUALITY", "fast")
+
+    photo = Photo(image_path)
+    min_image = photo.make_thumbnail((600, 450))
+
+    assert min_image.size == (600, 450)
+    assert min_image.mode == "RGBA"
+    assert photo._pil_image is None
+
+
+# Test that the watermark is drawn in place, near the bottom, with a cached tile
+def test_mark_image_composites_text_region_only(rgb_image, monkeypatch):
+    monkeypatch.setattr("photo.CONFIG.DIR_PATH", Path(__file__).parents[2])
+    monkeypatch.setattr("photo.CONFIG.FONT_FAMILY", "Eczar-Medium.ttf")
+    monkeypatch.setattr("photo.CONFIG.WATERMARK_ROTATE", 0)
+    photo = Photo(rgb_image)
+    image = photo.pil_image
+    before = image.copy()
+
+    signed = photo.mark_image(image, 40)
+    photo.mark_image(before.copy(), 40)
+
+    assert signed is image
+    changed = ImageChops.difference(before, signed).getbbox(alpha_only=False)
+    assert changed is not None
+    assert changed[1] > 600 / 2
+    assert _watermark_tile.cache_info().hits >= 1
+
+
+# Test that thumbnails match Image.thumbnail without copying the full-size pixels
+@pytest.mark.parametrize("size", [(600, 450), (600, 300), (100, 900), (900, 900)])
+def test_thumbnail_matches_pillow(rgb_image, monkeypatch, size):
+    monkeypatch.setattr("photo.CONFIG.THUMBNAIL_QUALITY", "exact")
+    photo = Photo(rgb_image)
+    expected = photo.pil_image.copy()
+    expected.thumbnail(size, Image.Resampling.LANCZOS)
+
+    min_image = photo.make_thumbnail(size)
+
+    assert min_image.size == expected.size
+    assert ImageChops.difference(min_image, expected).getbbox(alpha_only=False) is None
+
+
+# Test that the decoded pixels are dropped once the photo is written
+def test_format_releases_pixels(rgb_image, monkeypatch):
+    monkeypatch.setattr("photo.CONFIG.DIR_PATH", rgb_image.parent)
+    monkeypatch.setattr("photo.CONFIG.SIGN_ORIGINAL", False)
+    monkeypatch.setattr("photo.CONFIG.SIGN_THUMBNAIL", False)
+    photo = Photo(rgb_image)
+
+    photo.format()
+
+    assert photo.min_path.exists()
+    assert photo._pil_image is None
+
+
+# Test that every thumbnail width is written and listed for srcset
+def test_format_writes_thumbnail_ladder(rgb_image, monkeypatch):
+    monkeypatch.setattr("photo.CONFIG.DIR_PATH", rgb_image.parent)
+    monkeypatch.setattr("photo.CONFIG.SIGN_ORIGINAL", False)
+    monkeypatch.setattr("photo.CONFIG.SIGN_THUMBNAIL", False)
+    monkeypatch.setattr("photo.CONFIG.MIN_WIDTH", 300)
+    monkeypatch.setattr("photo.CONFIG.THUMBNAIL_WIDTHS", [200, 400, 1600])
+    photo = Photo(rgb_image)
+
+    result = photo.format()
+
+    assert result["min_path"] == "./rgb_image.min.webp"
+    assert result["srcset"] == [
+        {"width": 200, "height": 150, "path": "./rgb_image.200w.min.webp"},
+        {"width": 300, "height": 225, "path": "./rgb_image.min.webp"},
+        {"width": 400, "height": 300, "path": "./rgb_image.400w.min.webp"},
+    ]
+    for entry in result["srcset"]:
+        with Image.open(rgb_image.parent / entry["path"]) as image:
+            assert image.size == (entry["width"], entry["height"])
+    assert Photo(rgb_image).has_min
+
+
+# Test that the placeholder and dominant color come from the thumbnail
+def test_format_adds_placeholder(rgb_image, monkeypatch):
+    monkeypatch.setattr("photo.CONFIG.DIR_PATH", rgb_image.parent)
+    monkeypatch.setattr("photo.CONFIG.SIGN_ORIGINAL", False)
+    monkeypatch.setattr("photo.CONFIG.SIGN_THUMBNAIL", False)
+    monkeypatch.setattr("photo.CONFIG.PLACEHOLDER", True)
+
+    result = Photo(rgb_image).format()
+
+    color = bytes.fromhex(result["color"][1:])
+    assert all(abs(a - b) <= 3 for a, b in zip(color, (0, 128, 255)))
+    assert result["placeholder"].startswith("data:image/webp;base64,")
+    data = base64.b64decode(result["placeholder"].split(",", 1)[1])
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (16, 12)
+
+    # Read back from the thumbnail once it exists
+    assert Photo(rgb_image).format()["color"] == result["color"]
+
+
+# Test that a photo overwritten with its signed copy is never signed again
+def test_published_photo_is_not_signed_again(rgb_image, monkeypatch):
+    monkeypatch.setattr("photo.CONFIG.DIR_PATH", rgb_image.parent)
+    monkeypatch.setattr("photo.CONFIG.FONT_FAMILY", "Eczar-Medium.ttf")
+    monkeypatch.setattr("photo.CONFIG.SIGN_ORIGINAL", True)
+    monkeypatch.setattr("photo.CONFIG.SIGN_THUMBNAIL", False)
+    monkeypatch.setattr("photo.CONFIG.ORIGINAL_ENCODING", {"formats": ["jpeg"], "quality": 90})
+    Photo(rgb_image).format()
+    signed = rgb_image.read_bytes()
+
+    # A new width, or a lost thumbnail
+    monkeypatch.setattr("photo.CONFIG.THUMBNAIL_WIDTHS", [200])
+    Photo(rgb_image).format()
+
+    assert rgb_image.read_bytes() == signed
+    assert (rgb_image.parent / "rgb_image.200w.min.webp").exists()
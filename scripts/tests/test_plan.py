@@ -0,0 +1,47 @@
+import json
+from PIL import Image
+from cache import BuildCache
+from gallery import Gallery
+from plan import Plan, calibration
+
+
+def test_plan_changes_nothing(gallery_root):
+    before = sorted(gallery_root.rglob('*'))
+
+    plan = Plan().walk()
+
+    assert sorted(gallery_root.rglob('*')) == before
+    assert sorted(path.name for path, _, _ in plan.photos) == ['1.jpg', '1.jpg']
+    assert plan.megapixels == 2 * 0.48
+    assert [path.name for path in plan.album_files] == ['a.json', 'b.json']
+
+
+def test_plan_after_a_build(gallery_root):
+    cache = BuildCache(gallery_root / 'cache').load()
+    gallery = Gallery(cache=cache)
+    gallery.build()
+    gallery.write()
+    Image.new('RGB', (1000, 1000)).save(gallery_root / 'photos' / 'a' / '2.jpg')
+
+    plan = Plan(BuildCache(gallery_root / 'cache').load()).walk()
+
+    assert [(path.name, tasks) for path, tasks, _ in plan.photos] == [('2.jpg', ['1 thumbnail(s)', 'encode webp'])]
+    assert plan.cached == 1
+    assert plan.unchanged_albums == 1
+    assert [path.name for path in plan.album_files] == ['a.json']
+
+
+def test_estimate_from_profiled_build(gallery_root, tmp_path):
+    metrics = tmp_path / 'metrics.json'
+    metrics.write_text(json.dumps({
+        'wall_time': 5.0,
+        'all_photos': [{'total': 4.0, 'megapixels': 2.0}, {'total': 6.0, 'megapixels': 3.0}],
+    }))
+    # Two workers halved the 10s of work
+    assert calibration(metrics) == 1.0
+
+    plan = Plan().walk()
+
+    assert plan.estimate(metrics) == (plan.megapixels, 1.0)
+    assert plan.estimate(tmp_path / 'missing.json') is None
+    assert 'Estimated time: 1s' in plan.report(metrics)
@@ -0,0 +1,148 @@
+import time
+import pytest
+from PIL import Image
+from album import Album
+from conf import CONFIG
+import threading
+from pool import MemoryBudget, PhotoPool
+
+
+def make_gallery(root):
+    for album, names in {'a': ['1.jpg', '2.jpg', '3.jpg'], 'b/c': ['4.jpg', '5.jpg']}.items():
+        album_dir = root / 'photos' / album
+        album_dir.mkdir(parents=True)
+        for i, name in enumerate(names):
+            Image.new('RGB', (320 + i * 16, 240), (i * 40, 80, 160)).save(album_dir / name)
+    (root / 'albums').mkdir()
+
+
+@pytest.fixture
+def gallery_conf(monkeypatch):
+    monkeypatch.setattr(CONFIG, 'SIGN_ORIGINAL', False)
+    monkeypatch.setattr(CONFIG, 'SIGN_THUMBNAIL', False)
+    monkeypatch.setattr(CONFIG, 'MIN_WIDTH', 100)
+    monkeypatch.setattr(CONFIG, 'KEEP_ORDER', False)
+    monkeypatch.setattr(CONFIG, 'SORT_PHOTOS_BY_TIME', False)
+    monkeypatch.setattr(CONFIG, 'REVERSE_PHOTOS_ORDER', False)
+
+    def use(root):
+        monkeypatch.setattr(CONFIG, 'DIR_PATH', root)
+        monkeypatch.setattr(CONFIG, 'ALBUMS_PATH', root / 'albums')
+    return use
+
+
+def build(root, pool=None):
+    config = Album(root / 'photos', 'Horcrux', 0, pool).format()
+    albums = {p.name: p.read_bytes() for p in sorted((root / 'albums').iterdir())}
+    return config, albums
+
+
+def test_pool_output_matches_serial(tmp_path, gallery_conf):
+    serial_root, parallel_root = tmp_path / 'serial', tmp_path / 'parallel'
+    make_gallery(serial_root)
+    make_gallery(parallel_root)
+
+    gallery_conf(serial_root)
+    serial = build(serial_root)
+
+    gallery_conf(parallel_root)
+    with PhotoPool(2) as pool:
+        parallel = build(parallel_root, pool)
+
+    assert parallel == serial
+    assert list(serial[1]) == ['a.json', 'b-c.json']
+    assert (parallel_root / 'photos' / 'a' / '2.min.webp').exists()
+
+
+def test_album_files_can_be_skipped(tmp_path, gallery_conf, monkeypatch):
+    make_gallery(tmp_path)
+    gallery_conf(tmp_path)
+    monkeypatch.setattr(CONFIG, 'ALBUM_FILES', 'skip')
+
+    album = Album(tmp_path / 'photos', 'Horcrux', 0)
+    album.format()
+
+    assert list((tmp_path / 'albums').iterdir()) == []
+    assert album.leaves['./albums/a.json']['order'] == ['1.jpg', '2.jpg', '3.jpg']
+
+
+def test_memory_budget_output_matches_serial(tmp_path, gallery_conf):
+    serial_root, budget_root = tmp_path / 'serial', tmp_path / 'budget'
+    make_gallery(serial_root)
+    make_gallery(budget_root)
+
+    gallery_conf(serial_root)
+    serial = build(serial_root)
+
+    gallery_conf(budget_root)
+    # Room for one 320x240 photo at a time
+    with PhotoPool(2, memory_budget=0.1) as pool:
+        assert build(budget_root, pool) == serial
+        assert pool.budget.in_flight == 0
+
+
+def test_memory_budget_blocks_until_released():
+    budget = MemoryBudget(10)
+    budget.acquire(6)
+    acquired = threading.Event()
+
+    def acquire():
+        budget.acquire(6)
+        acquired.set()
+
+    threading.Thread(target=acquire).start()
+    time.sleep(0.05)
+    assert not acquired.is_set()
+    budget.release(6)
+    assert acquired.wait(1)
+    # Larger than the whole budget, but alone once the rest is released
+    budget.release(6)
+    budget.acquire(50)
+    assert budget.in_flight == 50
+
+
+def test_pipeline_output_matches_serial(tmp_path, gallery_conf, monkeypatch):
+    from pipeline import PhotoPipeline
+    serial_root, pipeline_root = tmp_path / 'serial', tmp_path / 'pipeline'
+    make_gallery(serial_root)
+    make_gallery(pipeline_root)
+    monkeypatch.setattr(CONFIG, 'SIGN_ORIGINAL', True)
+    monkeypatch.setattr(CONFIG, 'FONT_FAMILY', 'Eczar-Medium.ttf')
+    monkeypatch.setattr(CONFIG, 'WATERMARK_ROTATE', 0)
+
+    gallery_conf(serial_root)
+    serial = build(serial_root)
+
+    gallery_conf(pipeline_root)
+    with PhotoPipeline(2, queue_size=1) as pipeline:
+        assert build(pipeline_root, pipeline) == serial
+
+    for name in ['1', '2', '3']:
+        serial_file = serial_root / 'photos' / 'a' / f'{name}.webp'
+        assert (pipeline_root / 'photos' / 'a' / f'{name}.webp').read_bytes() == serial_file.read_bytes()
+        # The source is deleted once the watermarked photo is written
+        assert not (pipeline_root / 'photos' / 'a' / f'{name}.jpg').exists()
+
+
+def test_pipeline_keeps_to_the_memory_budget(tmp_path, gallery_conf):
+    from pipeline import PhotoPipeline
+    serial_root, pipeline_root = tmp_path / 'serial', tmp_path / 'pipeline'
+    make_gallery(serial_root)
+    make_gallery(pipeline_root)
+
+    gallery_conf(serial_root)
+    serial = build(serial_root)
+
+    gallery_conf(pipeline_root)
+    # Room for one 320x240 photo at a time
+    with PhotoPipeline(2, memory_budget=0.1) as pipeline:
+        assert build(pipeline_root, pipeline) == serial
+        assert pipeline.budget.in_flight == 0
+
+
+def test_pipeline_reports_missing_photos(tmp_path):
+    from pipeline import PhotoPipeline
+    with PhotoPipeline(1) as pipeline:
+        future = pipeline.submit(tmp_path / 'missing.jpg')
+    with pytest.raises(FileNotFoundError):
+        future.result()
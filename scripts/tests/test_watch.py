@@ -0,0 +1,95 @@
+import json
+import shutil
+from PIL import Image
+from conf import CONFIG
+from gallery import Gallery
+from watch import Watcher, snapshot, watched, changes
+
+
+def test_changes_between_snapshots(gallery_root):
+    before = snapshot(gallery_root / 'photos')
+    (gallery_root / 'photos' / 'a' / '2.jpg').write_bytes(b'new')
+    (gallery_root / 'photos' / 'b' / '1.jpg').unlink()
+    (gallery_root / 'photos' / '.DS_Store').write_bytes(b'')
+
+    assert changes(before, snapshot(gallery_root / 'photos')) == {
+        gallery_root / 'photos' / 'a' / '2.jpg',
+        gallery_root / 'photos' / 'b' / '1.jpg',
+    }
+
+
+def test_watcher_updates_only_changed_albums(gallery_root):
+    gallery = Gallery()
+    gallery.build()
+    gallery.write()
+    untouched = (gallery_root / 'albums' / 'b.json').stat().st_mtime_ns
+
+    watcher = Watcher(gallery)
+    previous = watched()
+    Image.new('RGB', (400, 600)).save(gallery_root / 'photos' / 'a' / '2.jpg')
+    (gallery_root / 'photos' / 'a' / 'new').mkdir()
+    Image.new('RGB', (400, 600)).save(gallery_root / 'photos' / 'a' / 'new' / '3.jpg')
+
+    previous, pending = watcher.poll(previous, set())
+    assert len(pending) == 3
+    previous, pending = watcher.poll(previous, pending)
+    assert pending == set()
+
+    assert gallery.tree['items']['dict']['a']['items']['order'] == ['1.jpg', '2.jpg', 'new']
+    assert (gallery_root / 'albums' / 'b.json').stat().st_mtime_ns == untouched
+    config = json.loads((gallery_root / 'config.json').read_text())
+    assert [album['name'] for album in config] == ['a', 'new', 'b']
+    assert config[0]['list'][1]['width'] == 400
+
+
+def test_watcher_ignores_its_own_outputs(gallery_root, monkeypatch):
+    monkeypatch.setattr(CONFIG, 'SIGN_ORIGINAL', True)
+    monkeypatch.setattr(CONFIG, 'FONT_FAMILY', 'Eczar-Medium.ttf')
+    gallery = Gallery()
+    gallery.build()
+    gallery.write()
+
+    watcher = Watcher(gallery)
+    previous = watched()
+    Image.new('RGB', (400, 600)).save(gallery_root / 'photos' / 'a' / '2.jpg')
+    previous, pending = watcher.poll(previous, set())
+    previous, pending = watcher.poll(previous, pending)
+
+    assert watcher.poll(previous, pending)[1] == set()
+    config = json.loads((gallery_root / 'config.json').read_text())
+    assert [photo['width'] for photo in config[0]['list']] == [800, 400]
+
+
+def test_watcher_removes_the_files_of_removed_albums(gallery_root):
+    gallery = Gallery()
+    gallery.build()
+    gallery.write()
+
+    watcher = Watcher(gallery)
+    previous = watched()
+    shutil.rmtree(gallery_root / 'photos' / 'b')
+    previous, pending = watcher.poll(previous, set())
+    watcher.poll(previous, pending)
+
+    assert not (gallery_root / 'albums' / 'b.json').exists()
+    assert './albums/b.json' not in gallery.leaves
+    config = json.loads((gallery_root / 'config.json').read_text())
+    assert [album['name'] for album in config] == ['a']
+
+
+def test_watcher_derives_replaced_sources_again(gallery_root):
+    gallery = Gallery()
+    gallery.build()
+    gallery.write()
+    untouched = (gallery_root / 'albums' / 'b.json').stat().st_mtime_ns
+
+    watcher = Watcher(gallery)
+    previous = watched()
+    Image.new('RGB', (400, 600)).save(gallery_root / '_sources' / 'a' / '1.jpg')
+    previous, pending = watcher.poll(previous, set())
+    assert pending == {gallery_root / '_sources' / 'a' / '1.jpg'}
+    watcher.poll(previous, pending)
+
+    assert (gallery_root / 'albums' / 'b.json').stat().st_mtime_ns == untouched
+    config = json.loads((gallery_root / 'config.json').read_text())
+    assert config[0]['list'][0]['width'] == 400
@@ -0,0 +1,81 @@
+import os
+import time
+from pathlib import Path
+from conf import CONFIG
+
+
+def snapshot(root):
+    """
+    Map every file and directory under root to (size, mtime), skipping dot files.
+    """
+    entries = {}
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                        entries[entry.path] = (None, None)
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            continue
+    return entries
+
+
+def watched():
+    """Snapshot of the photos and of the sources they are published from."""
+    return {**snapshot(CONFIG.PHOTOS_PATH), **snapshot(CONFIG.SOURCES_PATH)}
+
+
+def changes(old, new):
+    """Paths added, removed or modified between two snapshots."""
+    changed = set(old.keys() ^ new.keys())
+    changed.update(path for path in old.keys() & new.keys() if old[path] != new[path])
+    return {Path(path) for path in changed}
+
+
+class Watcher:
+    """
+    Poll CONFIG.PHOTOS_PATH and CONFIG.SOURCES_PATH and update the gallery
+    when photos change.
+
+    A change is processed once a poll sees no further change, so photos
+    still being copied in are not read half-written.
+    """
+    def __init__(self, gallery, interval=2.0):
+        self.gallery = gallery
+        self.interval = interval
+
+    def poll(self, previous, pending):
+        current = watched()
+        changed = changes(previous, current)
+        if changed:
+            return current, pending | changed
+        if pending:
+            try:
+                self.gallery.update(pending)
+                self.gallery.write()
+                print(f"Updated {len(pending)} changed path(s)")
+            except Exception as e:
+                print(f"Failed to update the gallery: {e}")
+            # Taken again, the files the update wrote or moved are no changes
+            current = watched()
+        return current, set()
+
+    def run(self):
+        print(f"Watching {CONFIG.PHOTOS_PATH} and {CONFIG.SOURCES_PATH} for changes, press Ctrl+C to stop")
+        previous, pending = watched(), set()
+        try:
+            while True:
+                time.sleep(self.interval)
+                previous, pending = self.poll(previous, pending)
+        except KeyboardInterrupt:
+            print('Stopped watching')